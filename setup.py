@@ -7,7 +7,8 @@ requirements = [
     # "statmodels",
     "tqdm",
     "numpy_ext",
-    "xlsxwriter"
+    "xlsxwriter",
+    "pyarrow"
     # "sqlalchemy"
 ]
 
@@ -1,6 +1,6 @@
-import logging
 from collections import namedtuple, defaultdict
 from datetime import date
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
@@ -8,6 +8,8 @@ import pandas as pd
 # from dsa.SharedModel import SharedModel
 from natsort import index_natsorted
 
+from dsa.data.DateIndex import day_index, month_index, day_index_to_str, month_start_sql
+
 Reports = namedtuple(
     "Reports",
     [
@@ -31,17 +33,19 @@ class Reporter:
         self.shared_model = shared_model
         self.args = args
 
-        self.has_new_data = self.shared_model.needs_new_report()
-        self.check_if_payed = self.shared_model.already_payed
         # self.compute_active_days()
         self.licence_threshold = 3
-        self.current_month = date.today().replace(day=1).strftime("%Y-%m-%d %H:%M:%S") #'2022-04-01 00:00:00'
+        self.current_month = month_index(date.today())
 
 
     @property
     def db(self):
         return self.shared_model.db
 
+    @property
+    def tables(self):
+        return self.shared_model.tables
+
     def get_filtration_rules(self):
         filtration_rules = "WHERE approved_status != 'NOT_APPROVED'"
         # filtration_rules = "WHERE profile_approved_status.role = 'STUDENT' AND approved_status != 'NOT_APPROVED'"
@@ -50,9 +54,9 @@ class Reporter:
     def get_date_filtration_rule(self):
         rules = []
         if self.freeze_date is not None:
-            rules.append(f"course_statistics.date < '{self.freeze_date}'")
-        if self.freeze_date is not None:
-            rules.append(f"course_statistics.date >= '{self.start_date}'")
+            rules.append(f"course_statistics.day < {day_index(self.freeze_date)}")
+        if self.start_date is not None:
+            rules.append(f"course_statistics.day >= {day_index(self.start_date)}")
         if len(rules) > 1:
             rule_str = " AND ".join(rules)
             return f"WHERE {rule_str}"
@@ -84,40 +88,35 @@ class Reporter:
     #         )
 
     def course_statistics_union(self):
-        return """
-        SELECT * from course_statistics_unified 
-        UNION ALL SELECT * from course_statistics_foxford
-        UNION ALL SELECT * from course_statistics_meo
-        UNION ALL SELECT * from course_statistics_uchi
-        """
+        return "\n        UNION ALL ".join(
+            f"SELECT * from {adapter.get_statistics_table_name()}" for adapter in self.shared_model.adapters
+        )
 
     def prepare_for_report(self):
-
-        if self.has_new_data:
-            logging.info("Computing full report")
-            for table_name in ["full_report", "active_days_count"]:
-                self.db.drop_table(table_name)
-
-            self.db.execute(
-                f"""
-                CREATE TABLE active_days_count AS
+        # report tables are rebuilt only when their inputs changed, see MaterializedTables
+        self.tables.define(
+            "active_days_count",
+            f"""
                 SELECT
-                educational_course_id, profile_id, created_at as "month_start",
-                CAST(COUNT(created_at) AS INTEGER) AS "active_days"
+                educational_course_id, profile_id, month, {month_start_sql("month")} as "month_start",
+                CAST(COUNT(day) AS INTEGER) AS "active_days"
                 FROM
                 course_statistics
                 {self.get_date_filtration_rule()}
-                GROUP BY educational_course_id, profile_id, created_at
-                """
-            )
+                GROUP BY educational_course_id, profile_id, month
+                """,
+            inputs=["course_statistics"],
+            parameters={"date_filter": self.get_date_filtration_rule()}
+        )
 
-            self.db.execute(
-                f"""
-                CREATE TABLE full_report AS
+        self.tables.define(
+            "full_report",
+            f"""
                 SELECT
                 course_titles.provider as "platform",
                 course_titles.course_name as "course_name",
                 active_days_count.month_start as "month_start",
+                active_days_count.month as "month",
                 profile_approved_status.profile_id as "profile_id",
                 profile_approved_status.profile_id_uuid as "profile_id_uuid",
                 profile_approved_status.approved_status as "approved_status",
@@ -137,13 +136,19 @@ class Reporter:
                 on active_days_count.educational_course_id = course_titles.course_id
                 LEFT JOIN student_grades on active_days_count.profile_id = student_grades.profile_id
                 WHERE (profile_approved_status.educational_institution_id != 'f04e94ca-f99f-4a77-af0a-a07094ccbcea' OR profile_approved_status.educational_institution_id != 'b345f7f7-bd59-42b7-80b9-a57613bd2924')
-                """
-            )
+                """,
+            inputs=[
+                "active_days_count", "profile_approved_status", "educational_institution", "course_information",
+                "student_grades"
+            ]
+        )
+        self.tables.refresh(["full_report"])
 
         self.full_report = self.db.query(
             """
             SELECT * from full_report
-            """
+            """,
+            uuid_columns=["profile_id_uuid"]
         )
         self.db.create_index_for_table(self.full_report, "full_report")
 
@@ -172,14 +177,9 @@ class Reporter:
         return user_report
 
     def convergence_stat(self):
-
-        if self.has_new_data:
-            logging.info("Computing convergence report")
-            self.db.drop_table("active_data")
-
-            self.db.execute(
-                """
-                CREATE TABLE active_data AS
+        self.tables.define(
+            "active_data",
+            """
                 SELECT
                 platform as "Активных дней", month_start as "Месяц",
                 CAST(COUNT(DISTINCT CASE WHEN active_days >= 1 THEN profile_id ELSE NULL END) AS INTEGER) as "1 день и более",
@@ -193,8 +193,10 @@ class Reporter:
                     GROUP BY platform, profile_id, month_start
                 )
                 GROUP BY platform, month_start
-                """
-            )
+                """,
+            inputs=["full_report"]
+        )
+        self.tables.refresh(["active_data"])
                         # CAST(COUNT(profile_id) AS INTEGER) as "Всего пользоателей"
 
         active_data = self.db.query("SELECT * FROM active_data").set_index("Активных дней").T
@@ -209,15 +211,9 @@ class Reporter:
         self._conv_stat = active_data[col_order]
 
     def prepare_report(self):
-
-        if self.has_new_data:
-            logging.info("Computing user and courses report")
-            self.db.drop_table("user_report")
-            self.db.drop_table("courses_report")
-
-            self.db.execute(
-                f"""
-                CREATE TABLE user_report AS
+        self.tables.define(
+            "user_report",
+            f"""
                 SELECT
                 platform as "Платформа",
                 month_start as "Начало месяца",
@@ -228,15 +224,16 @@ class Reporter:
                 WHERE ((role = 'TEACHER' AND platform = '1С:Урок') OR (role = 'STUDENT' AND platform != '1С:Урок'))           --role = 'STUDENT'
                 GROUP BY
                 platform, month_start
-                """
-            )
-
+                """,
+            inputs=["full_report"],
+            parameters={"licence_threshold": self.licence_threshold}
+        )
 
-            # this query has THEN 1 because one person can take one course only once
-            # no need to do DISTINCT
-            self.db.execute(
-                f"""
-                CREATE TABLE courses_report AS
+        # this query has THEN 1 because one person can take one course only once
+        # no need to do DISTINCT
+        self.tables.define(
+            "courses_report",
+            f"""
                 SELECT
                 Платформа,
                 Название,
@@ -260,8 +257,11 @@ class Reporter:
                     platform, course_name, month_start
                 ) AS usage 
                 LEFT JOIN billing_info on usage.course_id = billing_info.course_id
-                """
-            )
+                """,
+            inputs=["full_report", "billing_info"],
+            parameters={"licence_threshold": self.licence_threshold}
+        )
+        self.tables.refresh(["user_report", "courses_report"])
 
         self.user_report = self.db.query("SELECT * FROM user_report")
         self.courses_report = self.db.query("SELECT * FROM courses_report")
@@ -293,17 +293,18 @@ class Reporter:
     #             """
     #         )
 
-    def compute_region_info(self):
-        if self.has_new_data:
-            logging.info("Computing region report")
-            region_info = self.shared_model.read_table_dump(self.args.region_info, dtype={"ИНН": "string"})
-            self.db.replace_records(region_info, "region_info")
+    def import_region_info(self):
+        region_info = self.shared_model.read_table_dump(self.args.region_info, dtype={"ИНН": "string"})
+        self.db.replace_records(region_info, "region_info", uuid_columns=["profile_id"])
 
-            self.db.drop_table("region_info_activity")
-
-            self.db.execute(
-                f"""
-                CREATE TABLE region_info_activity AS
+    def compute_region_info(self):
+        self.tables.define(
+            "region_info", self.import_region_info,
+            parameters={"file_version": self.shared_model.register_file_version(Path(self.args.region_info))}
+        )
+        self.tables.define(
+            "region_info_activity",
+            f"""
                 SELECT
                 Регион, Школа, ИНН, Адрес,
                 COUNT(DISTINCT CASE WHEN role = 'STUDENT' THEN profile_id ELSE NULL END) AS "Всего учеников",
@@ -330,8 +331,11 @@ class Reporter:
                 ON active_people.profile_id_uuid = region_info.profile_id
                 GROUP BY Регион, Школа, ИНН, Адрес
                 ORDER BY "Всего подтверждённых учеников" DESC
-                """
-            )
+                """,
+            inputs=["region_info", "full_report"],
+            parameters={"licence_threshold": self.licence_threshold}
+        )
+        self.tables.refresh(["region_info_activity"])
 
         self.schools_activity = self.db.query("select * from region_info_activity")
 
@@ -369,9 +373,6 @@ class Reporter:
         self.get_people_for_billing()
         self.compute_region_info()
 
-        # self.shared_model.set_latest_report()
-        self.has_new_data = False
-
         self.user_report = self.add_licence_info(self.user_report, self.courses_report)
         return Reports(
             self.enrich_user_report(self.user_report),
@@ -383,99 +384,106 @@ class Reporter:
         )
 
     def get_people_for_billing(self):
-        if self.has_new_data:
-            logging.info("Computing people for billing")
-            self.db.drop_table("billing")
-            self.db.drop_table("people_billing_report")
-
-            self.db.execute(
-                f"""
-                CREATE TABLE billing AS
-                SELECT platform, course_name, month_start, profile_id, profile_id_uuid
+        self.tables.define(
+            "billing",
+            f"""
+                SELECT platform, course_name, month_start, profile_id, profile_id_uuid, month
                 FROM full_report
                 WHERE ((role = 'TEACHER' AND platform = '1С:Урок') OR (role = 'STUDENT' AND platform != '1С:Урок'))
-                AND active_days >= {self.licence_threshold} AND month_start = '{self.current_month}'
-                """
-            )
-
-            people_courses_for_billing = self.db.query("SELECT * FROM billing") \
-                .drop("profile_id", axis=1) \
-                .rename({"profile_id_uuid": "profile_id"}, axis=1)
-
-            list_of_already_payed = set()  ################ADDED HERE
-            if self.check_if_payed is not None:  ################ADDED HERE
-                list_of_already_payed = set(self.check_if_payed.copy())  ################ADDED HERE
+                AND active_days >= {self.licence_threshold} AND month = {self.current_month}
+                AND NOT EXISTS (
+                    SELECT 1 FROM already_payed
+                    WHERE already_payed.profile_id = full_report.profile_id AND already_payed.course_id = full_report.course_id
+                )
+                """,
+            inputs=["full_report", "already_payed"],
+            parameters={"licence_threshold": self.licence_threshold, "current_month": self.current_month}
+        )
+        self.tables.define(
+            "people_billing_report", self.compute_people_for_billing,
+            inputs=[
+                "billing", "course_statistics", "course_information", "profile_approved_status", "student_grades",
+                "educational_institution"
+            ],
+            parameters={"licence_threshold": self.licence_threshold}
+        )
+        self.tables.refresh(["people_billing_report"])
 
-            people_courses_filter = set(
-                (pl, c, m, per) for pl, c, m, per in people_courses_for_billing.values if (str(per), str(c), str(pl)) not in list_of_already_payed
-            )
-            # people_courses_filter_df = pd.DataFrame.from_records(list(people_courses_filter))
-            # people_courses_filter_df.to_csv('проверка_связи.csv')
+        self.billing = self.db.query("SELECT * FROM people_billing_report")
 
-            course_statistics = self.db.query(  # can improve filtration by adding course name to the filter
-                f"""
-                SELECT
-                DISTINCT provider, course_information.course_name, course_statistics.created_at as "month_start", profile_approved_status.profile_id_uuid as "profile_id", date as "visit_date",
-                grade
-                FROM
-                course_statistics
+    def compute_people_for_billing(self):
+        people_courses_for_billing = self.db.query("SELECT * FROM billing", uuid_columns=["profile_id_uuid"]) \
+            .drop("month", axis=1) \
+            .drop("profile_id", axis=1) \
+            .rename({"profile_id_uuid": "profile_id"}, axis=1)
+
+        # already paid licences are excluded by the billing query
+        people_courses_filter = set(map(tuple, people_courses_for_billing.values))
+        # people_courses_filter_df = pd.DataFrame.from_records(list(people_courses_filter))
+        # people_courses_filter_df.to_csv('проверка_связи.csv')
+
+        course_statistics = self.db.query(  # can improve filtration by adding course name to the filter
+            f"""
+            SELECT
+            DISTINCT provider, course_information.course_name, {month_start_sql("course_statistics.month")} as "month_start", profile_approved_status.profile_id_uuid as "profile_id", day as "visit_date",
+            grade
+            FROM
+            course_statistics
 --                 LEFT JOIN active_days_count ON active_days_count.profile_id = course_statistics.profile_id
-                LEFT JOIN course_information ON course_statistics.educational_course_id = course_information.course_id
-                LEFT JOIN profile_approved_status ON course_statistics.profile_id = profile_approved_status.profile_id
-                LEFT JOIN student_grades on course_statistics.profile_id = student_grades.profile_id
-                LEFT JOIN educational_institution ON profile_approved_status.educational_institution_id = educational_institution.educational_institution_id
-                WHERE (course_statistics.profile_id, provider, course_information.course_name, course_statistics.created_at) IN (
-                    SELECT DISTINCT profile_id, platform, course_name,month_start FROM billing
-                )
-                ORDER BY date
-                """,
-                chunksize=self.statistics_import_chunk_size
+            LEFT JOIN course_information ON course_statistics.educational_course_id = course_information.course_id
+            LEFT JOIN profile_approved_status ON course_statistics.profile_id = profile_approved_status.profile_id
+            LEFT JOIN student_grades on course_statistics.profile_id = student_grades.profile_id
+            LEFT JOIN educational_institution ON profile_approved_status.educational_institution_id = educational_institution.educational_institution_id
+            WHERE (course_statistics.profile_id, provider, course_information.course_name, course_statistics.month) IN (
+                SELECT DISTINCT profile_id, platform, course_name, month FROM billing
             )
+            ORDER BY day
+            """,
+            uuid_columns=["profile_id"],
+            chunksize=self.statistics_import_chunk_size
+        )
 
-            people_courses_visits = defaultdict(list)
-            grades = {}
-            for chunk in course_statistics:
-                for provider, course_name, month_start, profile_id, visit_date, grade in chunk[
-                    ["provider", "course_name", "month_start", "profile_id", "visit_date", "grade"]
-                ].values:
-                    key = (provider, course_name, month_start, profile_id)
-                    grades[profile_id] = grade
-                    if key not in people_courses_filter:
-                        continue
-                    if len(people_courses_visits[key]) == self.licence_threshold:
-                        continue
-                    people_courses_visits[key].append(visit_date)
-
-            records = []
-            for key, dates in people_courses_visits.items():
-                assert len(dates) == self.licence_threshold
-                platform, course_name, month_start, profile_id = key
-                # if (profile_id, course_name, platform) not in list_of_already_payed:  ################ADDED HERE
-                for ind, date in enumerate(dates):
-                    record = {
-                        "Наименование образовательной цифровой площадки": platform,
-                        "Наименование ЦОК": course_name,
-                        "Месяц": month_start,
-                        "Идентификационный номер обучающегося": profile_id,
-                        # "Класс": grades[profile_id],
-                        "Дата использования курса": date.split(" ")[0]
-                    }
-                    records.append(record)
-
-            data = pd.DataFrame.from_records(records, columns=[
-                "Наименование образовательной цифровой площадки", "Наименование ЦОК",
-                "Месяц", "Идентификационный номер обучающегося", "Дата использования курса"
-            ]).astype("string")
-
-            if len(data) > 0:
-                self.sort_course_names(data, ["Наименование ЦОК", "Наименование образовательной цифровой площадки"])
-
-            self.db.add_records(
-                data, "people_billing_report",
-                dtype={
-
+        people_courses_visits = defaultdict(list)
+        grades = {}
+        for chunk in course_statistics:
+            for provider, course_name, month_start, profile_id, visit_date, grade in chunk[
+                ["provider", "course_name", "month_start", "profile_id", "visit_date", "grade"]
+            ].values:
+                key = (provider, course_name, month_start, profile_id)
+                grades[profile_id] = grade
+                if key not in people_courses_filter:
+                    continue
+                if len(people_courses_visits[key]) == self.licence_threshold:
+                    continue
+                people_courses_visits[key].append(visit_date)
+
+        records = []
+        for key, dates in people_courses_visits.items():
+            assert len(dates) == self.licence_threshold
+            platform, course_name, month_start, profile_id = key
+            for ind, date in enumerate(dates):
+                record = {
+                    "Наименование образовательной цифровой площадки": platform,
+                    "Наименование ЦОК": course_name,
+                    "Месяц": month_start,
+                    "Идентификационный номер обучающегося": profile_id,
+                    # "Класс": grades[profile_id],
+                    "Дата использования курса": day_index_to_str(date)
                 }
-            )
+                records.append(record)
 
-        self.billing = self.db.query("SELECT * FROM people_billing_report")
+        data = pd.DataFrame.from_records(records, columns=[
+            "Наименование образовательной цифровой площадки", "Наименование ЦОК",
+            "Месяц", "Идентификационный номер обучающегося", "Дата использования курса"
+        ]).astype("string")
+
+        if len(data) > 0:
+            self.sort_course_names(data, ["Наименование ЦОК", "Наименование образовательной цифровой площадки"])
+
+        self.db.add_records(
+            data, "people_billing_report",
+            dtype={
+
+            }
+        )
 
@@ -1,79 +1,149 @@
+import json
 import logging
-from collections import namedtuple
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import pandas as pd
 import pickle
 
 from dsa.data import SQLTable, DBKVStore
-from dsa.data.adapters.DataAdapter import DataAdapter_United, DataAdapter_FoxFord, DataAdapter_MEO, DataAdapter_Uchi
+from dsa.data.DateIndex import to_day_index, month_index_sql
+from dsa.data.DependencyLoader import DependencyLoader
+from dsa.data.DumpReader import read_dump
+from dsa.data.FileVersionStore import FileVersionStore
+from dsa.data.IdDictionary import IdDictionary
+from dsa.data.MaterializedTables import MaterializedTables
+from dsa.data.QuarantineSink import QuarantineSink
+from dsa.data.TableDumpCache import TableDumpCache
+from dsa.data.adapters.AdapterRegistry import get_adapter_class, ingest_adapter_statistics
 
-MappingSpecification = namedtuple("MappingSpecification", ["table_name", "key_column", "value_column"])
+# increase when the layout of stored tables changes, the database is then imported again
+SCHEMA_VERSION = 8
 
 
 class SharedModel:
     def __init__(
             self, args
     ):
-        self.already_payed = None                                     ################ADDED HERE
         self.minute_activity = args.minute_activity
         self.resources_path = Path(args.resources_path)
         self.file_version_table_name = "file_versions"
         self.has_new_data = False
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
         self.set_paths()
 
-        self.db = SQLTable(self.db_path)
-        self.version_store = DBKVStore(
-            self.db.conn, table_name=self.file_version_table_name, key_column_name="filename",
-            value_column_name="version"
-        )
-        # self.version_store = DBKVStore(
-        #     self.db, table_name="program_state", key_column_name="parameter",
-        #     value_column_name="value"
-        # )
+        self.connect_db()
+        self.check_schema_version()
 
         self.load_state()
-        self.load_educational_institution(Path(args.educational_institution))
-        self.load_profile_approved_status(Path(args.profile_educational_institution))
-        self.load_student_grades(Path(args.student_grades))
-        self.load_external_system(Path(args.external_system))
-        self.load_course_types(args.course_types)
-        self.load_billing_info(Path(args.billing))
-        self.load_already_payed(args.payed)                                       ################ADDED HERE
+        self.load_inputs(args)
         self.prepare_data_adapters(args)
         self.import_statistics()
+        self.quarantine.close()
 
-    @staticmethod
-    def get_file_version(path: Path):
-        return int(path.stat().st_mtime)
+    def connect_db(self):
+        self.db = SQLTable(self.db_path)
+        self.state_store = DBKVStore(
+            self.db.conn, table_name="program_state", key_column_name="parameter", value_column_name="value"
+        )
+        self.version_store = FileVersionStore(self.db.conn, self.file_version_table_name)
+        self.quarantine = QuarantineSink(self.resources_path, self.db.conn, self.run_id)
+        self.tables = MaterializedTables(self.db)
+        self.dump_cache = TableDumpCache(self.resources_path.joinpath("dump_cache"), self.version_store.get_fingerprint)
+
+    def __getstate__(self):
+        # sqlite connections cannot be shared with adapter processes, each process opens its own
+        state = self.__dict__.copy()
+        for name in ["db", "state_store", "version_store", "quarantine", "tables", "dump_cache", "adapters"]:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.connect_db()
+        for mapping in self.mappings.values():
+            mapping.conn = self.db.conn
+
+    def check_schema_version(self):
+        if self.state_store.get("schema_version", 0) != SCHEMA_VERSION:
+            logging.info("Database layout has changed, dropping imported data")
+            for table_name in self.db.get_table_names():
+                if table_name != "program_state":
+                    self.db.drop_table(table_name)
+            self.state_store["schema_version"] = SCHEMA_VERSION
+            # tables of the stores were dropped as well
+            self.connect_db()
 
     @staticmethod
     def read_table_dump(path, *args, **kwargs):
-        return pd.read_csv(path, *args, **kwargs)
+        return read_dump(path, *args, **kwargs)
+
+    def read_dimension_dump(self, path, *args, **kwargs):
+        # for small dumps that are read on every run, versioned dumps are read only
+        # after they changed and would never be served from the cache
+        return self.dump_cache.read(path, *args, **kwargs)
+
+    def read_if_new_version(self, path, *args, **kwargs):
+        # the version is checked here because the db connection belongs to this thread,
+        # the returned reader gives None for a dump that was already imported
+        if not self.is_new_version(path):
+            return lambda: None
+        return partial(self.read_table_dump, path, *args, **kwargs)
+
+    def load_inputs(self, args):
+        # dumps are parsed concurrently, ids are allocated and tables written in dependency order,
+        # column types of the large dumps are declared in DumpReader.DUMP_SCHEMAS
+        institution_path = Path(args.educational_institution)
+        profile_path = Path(args.profile_educational_institution)
+        grades_path = Path(args.student_grades)
+        billing_path = Path(args.billing)
+
+        loader = DependencyLoader(args.loader_workers)
+        loader.add(
+            "educational_institution",
+            self.read_if_new_version(institution_path, schema="educational_institution"),
+            partial(self.load_educational_institution, institution_path)
+        )
+        loader.add(
+            "profile_approved_status",
+            self.read_if_new_version(profile_path, schema="profile_approved_status"),
+            partial(self.load_profile_approved_status, profile_path),
+            dependencies=["educational_institution"]
+        )
+        loader.add(
+            "student_grades",
+            self.read_if_new_version(grades_path, schema="student_grades"),
+            partial(self.load_student_grades, grades_path),
+            dependencies=["profile_approved_status"]
+        )
+        loader.add(
+            "external_system",
+            partial(self.read_dimension_dump, Path(args.external_system)),
+            self.load_external_system
+        )
+        loader.add("course_types", partial(self.read_dimension_dump, args.course_types), self.load_course_types)
+        loader.add(
+            "billing_info",
+            self.read_if_new_version(billing_path, schema="billing_info"),
+            partial(self.load_billing_info, billing_path),
+            dependencies=["external_system"]
+        )
+        payed_path = Path(args.payed)
+        loader.add(
+            "already_payed",
+            self.read_if_new_version(payed_path, schema="already_payed"),
+            partial(self.load_already_payed, payed_path),
+            dependencies=["external_system", "profile_approved_status", "billing_info"]
+        )
+        loader.run()
 
     def set_paths(self):
         self.state_file_path = self.resources_path.joinpath(f"{self.__class__.__name__}___state_file.json")
         self.db_path = self.resources_path.joinpath(f"{self.__class__.__name__}.db")
         self.mappings_path = self.resources_path.joinpath(f"{self.__class__.__name__}___mappings.pkl")
 
-    def load_mapping_from_db(self, specification: MappingSpecification):
-        table_name = specification.table_name
-        key_column = specification.key_column
-        value_column = specification.value_column
-
-        try:
-            mapping_df = self.db.query(
-                f"""
-                SELECT {key_column}, {value_column} from {table_name}
-                """
-            )
-            mapping = dict(zip(mapping_df[key_column], mapping_df[value_column]))
-
-            assert len(mapping_df) == len(mapping)
-        except pd.io.sql.DatabaseError:
-            mapping = {}
-        return mapping
-
     def load_state(self):
         logging.info("Loading previous state")
         self.load_mappings()
@@ -82,17 +152,12 @@ class SharedModel:
         self.has_new_data = flag_value
 
     def load_mappings(self):
-        self.mapping_specifications = {
-            'profile_id': MappingSpecification("profile_approved_status", "profile_id_uuid", "profile_id"),
-            'educational_institution_id': MappingSpecification("educational_institution", "educational_institution_id_uuid", "educational_institution_id"),
-            'provider_course_name': MappingSpecification("billing_info", "provider_course_name", "course_id"),
-            'educational_course_id': MappingSpecification("course_information", "educational_course_id_uuid", "educational_course_id"),
-            'educational_course_id2course_id': MappingSpecification("course_information", "educational_course_id", "course_id")
-        }
-        self.mappings = {key: self.load_mapping_from_db(spec) for key, spec in self.mapping_specifications.items()}
+        # id dictionaries are views of db tables, ids are read when they are looked up
+        self.mappings = {}
+        for column in ["profile_id", "educational_institution_id", "provider_course_name", "educational_course_id"]:
+            self.mappings[column] = IdDictionary(self.db.conn, column)
 
-    def load_course_types(self, path):
-        data = self.read_table_dump(path)
+    def load_course_types(self, data):
         self.course_types = {
             id_: type_name for id_, type_name in data.values
         }
@@ -100,53 +165,20 @@ class SharedModel:
     def get_course_type(self, type_id):
         return self.course_types[type_id]
 
-    @staticmethod
-    def add_missing_to_mapping(ids, mapping):
-        if len(mapping.values()) == 0:
-            valid_key = 0
-        else:
-            valid_key = max(mapping.values()) + 1
-        for id_ in ids:
-            if id_ not in mapping:
-                mapping[id_] = valid_key
-                valid_key += 1
-
     def convert_ids_to_int(self, table, columns, add_new=True):
         for column in columns:
             if column not in self.mappings:
-                mapping = {}
-                self.mappings[column] = mapping
-            else:
-                mapping = self.mappings[column]
-            uuid_name = f"{column}_uuid"
+                self.mappings[column] = IdDictionary(self.db.conn, column)
+            dictionary = self.mappings[column]
             if add_new:
-                self.add_missing_to_mapping(table[column].unique(), mapping)
-            table.eval(f"{uuid_name} = {column}", inplace=True)
-            table.eval(
-                f"{column} = {column}.map(@mapping)",
-                local_dict={"mapping": lambda id_: mapping.get(id_, pd.NA)},
-                inplace=True
-            )
-            # table[uuid_name] = table[column]
-            # table[column] = table[column].apply(lambda id_: mapping.get(id_, pd.NA))  # should fail for unknown ids
-            if add_new:
-                assert table[uuid_name].nunique() == table[column].nunique()
+                dictionary.allocate(table[column])
+            codes, unresolved = dictionary.encode(table[column])
+            table[f"{column}_uuid"] = table[column]
+            table[column] = codes.astype("Int64").mask(unresolved)
 
-    @staticmethod
-    def check_for_nas(data, field, path, error_buffer=None):
+    def check_for_nas(self, data, field, path):
         if data[field].hasnans:
-            nan_data = data[data[field].isna()]
-            path = Path(path)
-            parent = path.parent
-            name = path.name
-            error_filename = parent.joinpath(f"___{name}___{field}_nas.tsv")
-            if error_buffer is None:
-                nan_data.to_csv(error_filename, index=False, sep="\t")
-            else:
-                if error_filename in error_buffer:
-                    error_buffer[error_filename] = error_buffer[error_filename].append(nan_data)
-                else:
-                    error_buffer[error_filename] = nan_data
+            self.quarantine.add(data[data[field].isna()], f"missing_{field}", path)
             data.dropna(subset=[field], inplace=True)
 
         return data
@@ -159,55 +191,78 @@ class SharedModel:
         )
 
     def is_new_version(self, path: Path):
-        file_version = self.get_file_version(path)
-        last_file_version = self.version_store.get(str(path.name), default=0)
-        return file_version > last_file_version
+        return self.version_store.is_new_version(path)
 
     def save_current_file_version(self, path: Path):
-        self.version_store[str(path.name)] = self.get_file_version(path)
+        self.version_store.save_current_version(path)
 
     @staticmethod
     def merge_provider_with_course_name(table):
         table.eval("provider_course_name = provider.map(@add_spacing) + course_name", inplace=True,
                   local_dict={"add_spacing": lambda x: x + "_"})
 
-    def load_billing_info(self, path):
-        if self.is_new_version(path):
+    def load_billing_info(self, path, courses_prices):
+        if courses_prices is not None:
             logging.info("Importing billing info")
-            courses_prices = self.read_table_dump(path, dtype={"price": "Float32", "approved": "Float32"}, parse_dates=['approved_date'], infer_datetime_format=True)
             external_system_df = pd.DataFrame([{'system_code': sc, 'short_name': sn} for (sc, sn) in self.external_system.items()])
             data = pd.merge(courses_prices, external_system_df, how= 'left', on = 'system_code').rename({'short_name':'provider'}, axis = 1)
 
             data.drop_duplicates(subset=["provider", "course_name"], inplace=True)
             data.eval("approved = approved.fillna(0.)", inplace=True)
+            data["approved_day"] = to_day_index(data["approved_date"])
             self.merge_provider_with_course_name(data)
             self.convert_ids_to_int(data, ["provider_course_name"])
             data.rename({"provider_course_name": "course_id", "provider_course_name_uuid": "provider_course_name"}, axis=1, inplace=True)
             self.db.replace_records(
-                data[["provider", "course_name", "provider_course_name", "course_id", "price", "approved", "approved_date"]],
+                data[["provider", "course_name", "provider_course_name", "course_id", "price", "approved", "approved_date", "approved_day"]],
                 "billing_info",
                 dtype={
                     "course_id": "INT PRIMARY KEY",
                     "provider": "TEXT NOT NULL",
                     "course_name": "TEXT NOT NULL",
                     "price": "REAL NOT NULL",
-                    "approved": "REAL NOT NULL"
+                    "approved": "REAL NOT NULL",
+                    "approved_day": "INT"
                 }
             )
+            self.tables.bump("billing_info")
             self.save_current_file_version(path)
 
-    def load_already_payed(self, path):
-        payed_df = pd.read_csv(path, dtype={'profile_id':'string',
-                                           'course_name':'string',
-                                           'system_code':'string'})
-        external_system_df = pd.DataFrame([{'system_code':sc, 'short_name':sn} for (sc, sn) in self.external_system.items()])
-        payed_last_year = pd.merge(payed_df, external_system_df, how = 'left', on = 'system_code')
-        self.already_payed = list(zip(payed_last_year['profile_id'], payed_last_year['course_name'], payed_last_year['short_name']))
+    def load_already_payed(self, path, payed_df):
+        # paid licences are kept by int ids, the billing query excludes them with an indexed anti-join.
+        # Only known profiles and billed courses are resolved, so the list is imported again when
+        # profiles or billing change, a licence of a profile or course that appears later is picked up then
+        dependencies = json.dumps({name: self.tables.get_version(name) for name in ["profile_approved_status", "billing_info"]})
+        if payed_df is None and self.tables.get_inputs("already_payed") != dependencies:
+            payed_df = self.read_table_dump(path, schema="already_payed")
+        if payed_df is not None:
+            logging.info("Importing already paid licences")
+            source = str(path.absolute()) + f"_{self.__class__.__name__}"
+            external_system_df = pd.DataFrame([{'system_code':sc, 'short_name':sn} for (sc, sn) in self.external_system.items()])
+            data = pd.merge(payed_df, external_system_df, how='left', on='system_code').rename({'short_name': 'provider'}, axis=1)
+            for field in ["profile_id", "provider", "course_name"]:
+                self.check_for_nas(data, field, source)
+            self.merge_provider_with_course_name(data)
+            self.convert_ids_to_int(data, ["profile_id", "provider_course_name"], add_new=False)
+            for field in ["profile_id", "provider_course_name"]:
+                unresolved = data[field].isna()
+                if unresolved.any():
+                    self.quarantine.add(data[unresolved], f"unresolved_{field}", source)
+                    data = data[~unresolved]
+            data = data.rename({"provider_course_name": "course_id"}, axis=1) \
+                .drop_duplicates(subset=["profile_id", "course_id"])
+            self.db.replace_records(
+                data[["profile_id", "course_id"]],
+                "already_payed",
+                dtype={"profile_id": "INT NOT NULL", "course_id": "INT NOT NULL"}
+            )
+            self.tables.set_version("already_payed", dependencies)
+            self.save_current_file_version(path)
 
-    def load_student_grades(self, path):
-        if self.is_new_version(path):
+    def load_student_grades(self, path, data):
+        if data is not None:
             logging.info("Importing student grades")
-            data = self.read_table_dump(path, dtype={"grade": "Int32"}).rename({"id": "profile_id"}, axis=1)
+            data = data.rename({"id": "profile_id"}, axis=1)
             self.convert_ids_to_int(data, ["profile_id"], add_new=False)
             for field in ["grade", "profile_id"]:
                 self.check_for_nas(data, field, str(path.absolute()) + f"_{self.__class__.__name__}")
@@ -220,10 +275,10 @@ class SharedModel:
                     "grade": "INT", "is_deleted": "INT NOT NULL"
                 }
             )
+            self.tables.bump("student_grades")
             self.save_current_file_version(path)
 
-    def load_external_system(self, path):
-        data = self.read_table_dump(path)
+    def load_external_system(self, data):
         self.external_system = dict(zip(data["system_code"], data["short_name"]))
 
     # def read_paper_letters_info(self, path):
@@ -268,15 +323,13 @@ class SharedModel:
     #     special_status = pd.DataFrame.from_records(special_status_records)
     #     return special_status
 
-    def load_educational_institution(self, path):
+    def load_educational_institution(self, path, data):
         # approved_in_november_path = path.parent.joinpath("approved_in_november____.csv")
         # letter_schools_path = path.parent.joinpath("schools_paper_letters.csv")
         # or self.is_new_version(approved_in_november_path) or self.is_new_version(letter_schools_path):
-        if self.is_new_version(path):
+        if data is not None:
             logging.info("Importing educational institutions")
-            path = Path(path)
-            data = self.read_table_dump(path, dtype={"inn": "Int64"}) \
-                .rename({"id": "educational_institution_id"}, axis=1)
+            data = data.rename({"id": "educational_institution_id"}, axis=1)
 
             # paper_letters = self.read_paper_letters_info(letter_schools_path)
             #
@@ -297,20 +350,21 @@ class SharedModel:
             self.db.replace_records(
                 merged[["educational_institution_id", "educational_institution_id_uuid"]],#, "special_status"]],
                 "educational_institution",
+                uuid_columns=["educational_institution_id_uuid"],
                 dtype={
                     "educational_institution_id": "INT PRIMARY KEY",
-                    "educational_institution_id_uuid": "TEXT UNIQUE NOT NULL"#,
+                    "educational_institution_id_uuid": "BLOB UNIQUE NOT NULL"#,
                     # "special_status": "TEXT"
                 }
             )
+            self.tables.bump("educational_institution")
             self.save_current_file_version(path)
             # self.save_current_file_version(approved_in_november_path)
             # self.save_current_file_version(letter_schools_path)
 
-    def load_profile_approved_status(self, path):
-        if self.is_new_version(path):
+    def load_profile_approved_status(self, path, data):
+        if data is not None:
             logging.info("Importing profiles")
-            data = self.read_table_dump(path, parse_dates=["updated_at", "approval_date"])
             self.convert_ids_to_int(data, ["profile_id"])
             self.convert_ids_to_int(data, ["educational_institution_id"], add_new=False)
             for field in ["profile_id", "educational_institution_id"]:
@@ -323,9 +377,10 @@ class SharedModel:
                     "educational_institution_id",
                     "is_deleted"
                 ]], "profile_approved_status",
+                uuid_columns=["profile_id_uuid"],
                 dtype={
                     "profile_id": "INT PRIMARY KEY",
-                    "profile_id_uuid": "TEXT UNIQUE NOT NULL",
+                    "profile_id_uuid": "BLOB UNIQUE NOT NULL",
                     "approved_status": "TEXT",
                     "role": "TEXT",
                     "educational_institution_id": "INT NOT NULL",
@@ -333,45 +388,61 @@ class SharedModel:
                     "is_deleted": "INT NOT NULL"
                 }
             )  # updated_at
+            self.tables.bump("profile_approved_status")
             self.save_current_file_version(path)
 
     def prepare_data_adapters(self, args):
-        self.adapters = [
-            DataAdapter_United(shared_model=self, args=args)
-            # DataAdapter_FoxFord(shared_model=self, args=args),
-            # DataAdapter_MEO(shared_model=self, args=args),
-            # DataAdapter_Uchi(shared_model=self, args=args)
-        ]
+        self.adapters = [get_adapter_class(name)(shared_model=self, args=args) for name in args.adapters]
+        # course structures allocate new course ids, so they are loaded one after another in this process
+        for adapter in self.adapters:
+            adapter.load_course_structure(adapter.get_course_structure_path(args))
+        self.ingest_adapter_statistics(args.adapter_workers)
+
+    def ingest_adapter_statistics(self, workers=None):
+        # statistics of different platforms are independent and go to per-adapter tables,
+        # so every adapter preprocesses and loads them in its own process
+        if len(self.adapters) == 1:
+            self.adapters[0].ingest_statistics()
+            return
+        with ProcessPoolExecutor(workers or len(self.adapters)) as executor:
+            for adapter, has_new_data in zip(self.adapters, executor.map(ingest_adapter_statistics, self.adapters)):
+                adapter.has_new_data = has_new_data
 
     def import_statistics(self):
-        self.db.drop_table("course_statistics")
+        statistics_tables = [adapter.get_statistics_table_name() for adapter in self.adapters]
+        self.tables.define("course_statistics", self.build_course_statistics, inputs=statistics_tables + ["billing_info"])
+        self.tables.refresh(["course_statistics"])
+
+    def build_course_statistics(self):
+        # the table is built inside sqlite, rows do not pass through pandas
+        self.db.execute(
+            "CREATE TABLE course_statistics (profile_id INTEGER, educational_course_id INTEGER, day INTEGER, month INTEGER)"
+        )
         for adapter in self.adapters:
-            adapter_data = self.db.query(
+            # adapter tables are distinct within every source file, see DataAdapter.iterate_preprocessed.
+            # Duplicates between files are adjacent in the (profile_id, educational_course_id, day) index
+            # of the table, so the distinct subquery is a scan of that index and does not sort the rows
+            self.db.execute(
                 f"""
+                INSERT INTO course_statistics
                 SELECT
-                DISTINCT profile_id, educational_course_id, created_at
-                FROM {adapter.get_statistics_table_name()}
-                LEFT JOIN billing_info ON educational_course_id = course_id
-                WHERE created_at >= billing_info.approved_date
-                ORDER BY profile_id, educational_course_id, created_at
-                """, chunksize=1000000)
-            for chunk in adapter_data:
-                chunk['created_at'] = pd.to_datetime(chunk['created_at'])
-                chunk['date'] = chunk['created_at']
-                chunk["created_at"] = chunk["created_at"].apply(lambda date: date.replace(day=1))
-                self.db.add_records(chunk, "course_statistics")
-
-    def needs_new_report(self):
-        file_versions = self.db.query(f"select version from {self.file_version_table_name} where filename != 'report_version'")
-        report_version = self.version_store.get("report_version", 0)
-        if len(file_versions) == 0:
-            raise Exception("Unknown error")
-        last_file_version = int(file_versions["version"].max())
-        return last_file_version > report_version
-
-    def set_latest_report(self):
-        file_versions = self.db.query(f"select version from {self.file_version_table_name} where filename != 'report_version'")
-        if len(file_versions) == 0:
-            raise Exception("Unknown error")
-        last_file_version = int(file_versions["version"].max())
-        self.version_store["report_version"] = last_file_version
+                events.profile_id, events.educational_course_id, events.day, {month_index_sql("events.day")}
+                FROM (
+                    SELECT DISTINCT profile_id, educational_course_id, day
+                    FROM {adapter.get_statistics_table_name()}
+                ) AS events
+                JOIN billing_info ON events.educational_course_id = billing_info.course_id
+                WHERE events.day >= billing_info.approved_day
+                """
+            )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_course_statistics "
+            "ON course_statistics(profile_id, educational_course_id, day, month)"
+        )
+
+    def register_file_version(self, path: Path):
+        # for files that are read by derived tables, see MaterializedTables. A changed file
+        # is saved as a new version, the returned version is the one of the current content
+        if self.is_new_version(path):
+            self.save_current_file_version(path)
+        return self.version_store.get(path.name).version
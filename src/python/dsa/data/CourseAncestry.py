@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+STRUCTURE_COLUMNS = ["id", "parent_id", "course_name", "course_type_id", "system_code", "is_deleted"]
+
+
+class CourseAncestry:
+    def __init__(self, db, structure_table_name, ancestry_table_name):
+        # the structure table keeps the nodes of the last imported dump, the ancestry table
+        # keeps the root of every node, so a new dump only needs the changed subtrees resolved
+        self.db = db
+        self.structure_table_name = structure_table_name
+        self.ancestry_table_name = ancestry_table_name
+
+    @staticmethod
+    def make_snapshot(data):
+        # values are compared as text so that they survive the round trip through the db
+        return data[STRUCTURE_COLUMNS].astype("string").reset_index(drop=True)
+
+    def has_table(self, table_name):
+        return table_name in self.db.get_table_names()
+
+    def load_snapshot(self):
+        if not self.has_table(self.structure_table_name):
+            return pd.DataFrame(columns=STRUCTURE_COLUMNS, dtype="string")
+        return self.db.query(
+            f"SELECT {', '.join(STRUCTURE_COLUMNS)} FROM {self.structure_table_name}"
+        ).astype("string")
+
+    def diff(self, snapshot):
+        # returns ids of nodes that were added, modified or removed, and separately the removed ones
+        previous = self.load_snapshot()
+        changed = pd.concat([previous, snapshot]).drop_duplicates(keep=False)["id"].unique()
+        removed = previous["id"][~previous["id"].isin(snapshot["id"])]
+        return np.asarray(changed, dtype=object), removed.to_numpy(dtype=object)
+
+    def get_roots(self, ids):
+        # roots stored for the given ids, missing for unknown ids and for nodes without a root
+        if not self.has_table(self.ancestry_table_name):
+            return np.full(len(ids), None, dtype=object)
+        ancestry = self.db.query(f"SELECT id, root_id FROM {self.ancestry_table_name}")
+        return pd.Series(ancestry["root_id"].to_numpy(dtype=object), index=ancestry["id"]) \
+            .reindex(np.asarray(ids, dtype=object)).to_numpy(dtype=object)
+
+    def save(self, nodes, ancestry, removed_ids):
+        self.db.delete_records(
+            self.structure_table_name, "id", pd.unique(np.concatenate([nodes["id"].to_numpy(dtype=object), removed_ids]))
+        )
+        self.db.add_records(nodes, self.structure_table_name)
+        self.db.delete_records(
+            self.ancestry_table_name, "id", pd.unique(np.concatenate([ancestry["id"].to_numpy(dtype=object), removed_ids]))
+        )
+        self.db.add_records(ancestry, self.ancestry_table_name)
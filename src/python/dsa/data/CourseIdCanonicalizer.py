@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+STRUCTURE_PREFIXES = ("Lesson_", "Chapter_", "Topic_", "Course_")
+
+
+def map_unique(ids, transform):
+    # course ids repeat a lot, so the transformation runs once per distinct id
+    # and is broadcast back to the rows with the factorized codes
+    codes, uniques = pd.factorize(ids)
+    if len(uniques) == 0:
+        return pd.Series(np.full(len(ids), None, dtype=object), index=ids.index)
+    uniques = pa.array(np.asarray(uniques, dtype=object), type=pa.string())
+    transformed = transform(uniques).to_numpy(zero_copy_only=False)
+    return pd.Series(np.where(codes >= 0, transformed[codes], None), index=ids.index, dtype=object)
+
+
+def truncate_id_levels(ids, levels, separator="/"):
+    return pc.replace_substring_regex(
+        ids, pattern=f"^((?:[^{separator}]*{separator}){{{levels - 1}}}[^{separator}]*){separator}.*$",
+        replacement="\\1"
+    )
+
+
+def remove_last_id_level(ids, separator="/"):
+    return pc.replace_substring_regex(ids, pattern=f"{separator}[^{separator}]*$", replacement="")
+
+
+class CourseIdCanonicalizer:
+    def __init__(self, known_ids, prefixes=STRUCTURE_PREFIXES):
+        self.known_ids = pa.array(pd.unique(np.asarray(list(known_ids), dtype=object)), type=pa.string())
+        self.prefixes = prefixes
+
+    def is_known(self, ids):
+        return pc.is_in(ids, value_set=self.known_ids)
+
+    def resolve(self, ids):
+        # same lookup order as the former per-id search in DataAdapter.find_subject:
+        # FoxFord ids lose their last level, then structure prefixes are tried one by one
+        found = self.is_known(ids)
+        current = ids
+        foxford = pc.fill_null(pc.and_(pc.invert(found), pc.match_substring(ids, "foxford")), False)
+        current = pc.if_else(foxford, remove_last_id_level(ids), current)
+        found = self.is_known(current)
+        for prefix in self.prefixes:
+            candidate = pc.binary_join_element_wise(prefix, current, "")
+            hit = pc.and_(pc.invert(found), self.is_known(candidate))
+            current = pc.if_else(hit, candidate, current)
+            found = pc.or_(found, hit)
+        return pc.if_else(found, current, ids)
+
+    def canonicalize(self, ids):
+        # unresolved ids are returned unchanged
+        return map_unique(ids, self.resolve)
+
+
+def truncate_course_ids(ids, levels):
+    return map_unique(ids, lambda uniques: truncate_id_levels(uniques, levels))
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+
+def find_tops(ids, parent_ids):
+    # returns for every node the position of its highest ancestor among the given nodes,
+    # that is the first node on the way up whose parent is empty or not among the given ids
+    ids = pd.Index(np.asarray(ids, dtype=object))
+    num_nodes = len(ids)
+    parents = ids.get_indexer(np.asarray(parent_ids, dtype=object))
+    has_parent = parents >= 0
+
+    # pointer jumping on positions, top nodes point to themselves and
+    # every pass doubles the distance covered by a pointer
+    pointers = np.where(has_parent, parents, np.arange(num_nodes))
+    for _ in range(num_nodes.bit_length() + 1):
+        jumped = pointers[pointers]
+        if np.array_equal(jumped, pointers):
+            break
+        pointers = jumped
+    else:
+        raise ValueError("Course structure contains cycles")
+
+    if has_parent[pointers].any():
+        raise ValueError("Course structure contains cycles")
+    return pointers
+
+
+def find_descendants(ids, parent_ids, roots):
+    # marks the given roots and every node below them, the structure is only
+    # a few levels deep so this takes a few passes over the parent column
+    ids = np.asarray(ids, dtype=object)
+    parent_ids = pd.Series(np.asarray(parent_ids, dtype=object))
+    marked = pd.Series(ids).isin(roots).to_numpy()
+    frontier = roots
+    while len(frontier) > 0:
+        children = parent_ids.isin(frontier).to_numpy() & ~marked
+        marked |= children
+        frontier = ids[children]
+    return marked
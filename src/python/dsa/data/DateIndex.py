@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+# event dates are stored as days since 1970-01-01, computed as int32 when preprocessed statistics are
+# imported into the db, months since 1970-01 are computed from them in sqlite, see month_index_sql
+EPOCH = pd.Timestamp("1970-01-01")
+
+
+def to_day_index(dates):
+    days = pd.Series(dates.to_numpy(dtype="datetime64[D]").astype(np.int32), index=dates.index)
+    if dates.hasnans:
+        days = days.astype("Int32").mask(dates.isna())
+    return days
+
+
+def day_index(value):
+    return (pd.Timestamp(value).normalize() - EPOCH).days
+
+
+def month_index(value):
+    value = pd.Timestamp(value)
+    return (value.year - EPOCH.year) * 12 + value.month - 1
+
+
+def day_index_to_str(day):
+    return (EPOCH + timedelta(days=int(day))).strftime("%Y-%m-%d")
+
+
+def month_index_sql(column):
+    # month index of a day index column, computed by sqlite
+    date = f"date({column} * 86400, 'unixepoch')"
+    return f"((CAST(strftime('%Y', {date}) AS INTEGER) - 1970) * 12 + CAST(strftime('%m', {date}) AS INTEGER) - 1)"
+
+
+def month_start_sql(column):
+    # same text as the month start timestamps stored by earlier versions
+    return f"datetime('1970-01-01', '+' || {column} || ' months')"
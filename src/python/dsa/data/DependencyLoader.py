@@ -0,0 +1,37 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class DependencyLoader:
+    def __init__(self, workers=None):
+        # every task is a read, that only parses a file and runs in a worker thread, and a load,
+        # that writes to the db and runs in the calling thread once the loads it depends on are done
+        self.workers = workers
+        self.tasks = OrderedDict()
+
+    def add(self, name, read, load, dependencies=()):
+        self.tasks[name] = (read, load, tuple(dependencies))
+
+    def check_dependencies(self):
+        for name, (_, _, dependencies) in self.tasks.items():
+            for dependency in dependencies:
+                if dependency not in self.tasks:
+                    raise ValueError(f"Unknown dependency {dependency} of {name}")
+
+    def run(self):
+        self.check_dependencies()
+        with ThreadPoolExecutor(self.workers) as executor:
+            reads = {name: executor.submit(read) for name, (read, _, _) in self.tasks.items()}
+            loaded = set()
+            pending = list(self.tasks)
+            while len(pending) > 0:
+                ready = [name for name in pending if all(dependency in loaded for dependency in self.tasks[name][2])]
+                if len(ready) == 0:
+                    raise ValueError(f"Cyclic dependencies between {', '.join(pending)}")
+                # loads run in the order their reads finish, the earliest declared first among finished ones
+                wait([reads[name] for name in ready], return_when=FIRST_COMPLETED)
+                for name in ready:
+                    if reads[name].done():
+                        self.tasks[name][1](reads[name].result())
+                        loaded.add(name)
+                        pending.remove(name)
@@ -0,0 +1,60 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+# types of the columns the loaders rely on, by dump. Other columns are typed by arrow inference.
+# "object" columns are read as text and stay python strings, as pandas would leave them
+DUMP_SCHEMAS = {
+    "educational_institution": {"id": "object", "inn": "Int64"},
+    "profile_approved_status": {
+        "profile_id": "object", "educational_institution_id": "object", "approved_status": "object",
+        "role": "object", "is_deleted": "object", "updated_at": "datetime64[ns]", "approval_date": "datetime64[ns]"
+    },
+    "student_grades": {"id": "object", "grade": "Int32", "is_deleted": "object"},
+    "billing_info": {
+        "course_name": "object", "price": "Float32", "approved": "Float32", "approved_date": "datetime64[ns]"
+    },
+    "already_payed": {"profile_id": "string", "course_name": "string", "system_code": "string"},
+}
+
+ARROW_TYPES = {
+    "object": pa.string(),
+    "string": pa.string(),
+    "Int64": pa.int64(),
+    "Int32": pa.int32(),
+    "Float32": pa.float32(),
+    "datetime64[ns]": pa.timestamp("ns"),
+}
+
+TIMESTAMP_PARSERS = [pacsv.ISO8601]
+
+# the markers pandas.read_csv treats as missing
+NULL_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA",
+    "NULL", "NaN", "None", "n/a", "nan", "null"
+]
+
+
+def read_dump(path, *args, schema=None, **kwargs):
+    # dumps with a declared schema are parsed by the multithreaded arrow reader, others by pandas
+    if schema is None:
+        return pd.read_csv(path, *args, **kwargs)
+    return read_dump_with_arrow(path, DUMP_SCHEMAS[schema])
+
+
+def read_dump_with_arrow(path, dtypes):
+    table = pacsv.read_csv(
+        path,
+        read_options=pacsv.ReadOptions(use_threads=True),
+        convert_options=pacsv.ConvertOptions(
+            column_types={column: ARROW_TYPES[dtype] for column, dtype in dtypes.items()},
+            timestamp_parsers=TIMESTAMP_PARSERS,
+            null_values=NULL_VALUES,
+            strings_can_be_null=True
+        )
+    )
+    data = table.to_pandas()
+    for column, dtype in dtypes.items():
+        if column in data.columns and dtype not in ("object", "datetime64[ns]"):
+            data[column] = data[column].astype(dtype)
+    return data
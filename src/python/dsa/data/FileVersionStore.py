@@ -0,0 +1,90 @@
+import os
+import zlib
+from collections import namedtuple
+
+FINGERPRINT_BLOCK = 1024 ** 2
+# files up to this size are hashed completely, larger ones by evenly spaced blocks
+FULL_FINGERPRINT_LIMIT = 256 * 1024 ** 2
+FINGERPRINT_SAMPLES = 64
+
+FileVersion = namedtuple("FileVersion", ["version", "size", "mtime", "fingerprint"])
+
+
+def file_fingerprint(path, size=None):
+    if size is None:
+        size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        if size <= FULL_FINGERPRINT_LIMIT:
+            offsets = range(0, size, FINGERPRINT_BLOCK)
+        else:
+            # the last block ends exactly at the end of the file, appended and truncated dumps change it
+            step = (size - FINGERPRINT_BLOCK) // (FINGERPRINT_SAMPLES - 1)
+            offsets = [ind * step for ind in range(FINGERPRINT_SAMPLES - 1)] + [size - FINGERPRINT_BLOCK]
+        checksum = 0
+        for offset in offsets:
+            file.seek(offset)
+            checksum = zlib.crc32(file.read(FINGERPRINT_BLOCK), checksum)
+    return f"{size:x}-{checksum:08x}"
+
+
+class FileVersionStore:
+    def __init__(self, db_conn, table_name):
+        # version is a counter that grows only when the content of some file changes,
+        # size and mtime let unchanged files skip hashing
+        self.table_name = table_name
+        self.conn = db_conn
+        self.conn.execute(
+            f"create table if not exists {self.table_name} (filename TEXT PRIMARY KEY, version INTEGER, "
+            f"size INTEGER, mtime INTEGER, fingerprint TEXT)"
+        )
+        self.fingerprints = {}
+
+    def get(self, filename):
+        result = self.conn.execute(
+            f"SELECT version, size, mtime, fingerprint FROM {self.table_name} WHERE filename = ?", (filename,)
+        ).fetchone()
+        return None if result is None else FileVersion(*result)
+
+    def get_fingerprint(self, path, size, mtime):
+        # remembered for the run, is_new_version and save_current_version usually look at the same file
+        key = (str(path), size, mtime)
+        if key not in self.fingerprints:
+            self.fingerprints[key] = file_fingerprint(path, size)
+        return self.fingerprints[key]
+
+    def is_new_version(self, path):
+        stat = path.stat()
+        last = self.get(path.name)
+        if last is None:
+            return True
+        if last.size == stat.st_size and last.mtime == stat.st_mtime_ns:
+            return False
+        if self.get_fingerprint(path, stat.st_size, stat.st_mtime_ns) != last.fingerprint:
+            return True
+        # same content under a new timestamp, the new mtime spares hashing it next time
+        self.conn.execute(
+            f"UPDATE {self.table_name} SET mtime = ? WHERE filename = ?", (stat.st_mtime_ns, path.name)
+        )
+        self.conn.commit()
+        return False
+
+    def save_current_version(self, path):
+        stat = path.stat()
+        fingerprint = self.get_fingerprint(path, stat.st_size, stat.st_mtime_ns)
+        last = self.get(path.name)
+        if last is not None and last.fingerprint == fingerprint:
+            version = last.version
+        else:
+            version = self.get_last_version() + 1
+        self.conn.execute(
+            f"REPLACE INTO {self.table_name} VALUES (?,?,?,?,?)",
+            (path.name, version, stat.st_size, stat.st_mtime_ns, fingerprint)
+        )
+        self.conn.commit()
+
+    def delete(self, filename):
+        self.conn.execute(f"DELETE FROM {self.table_name} WHERE filename = ?", (filename,))
+        self.conn.commit()
+
+    def get_last_version(self):
+        return self.conn.execute(f"SELECT COALESCE(MAX(version), 0) FROM {self.table_name}").fetchone()[0]
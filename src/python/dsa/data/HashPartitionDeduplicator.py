@@ -0,0 +1,97 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+PARTITION_BITS = 6
+MAX_LEVEL = 64 // PARTITION_BITS
+# columns are spilled as int64, plus the hash table built by drop_duplicates
+BYTES_PER_VALUE = 32
+
+
+class HashPartitionDeduplicator:
+    def __init__(self, columns, spill_path, memory_limit=1024 ** 3, level=0):
+        self.columns = columns
+        self.memory_limit = memory_limit
+        self.level = level
+        self.num_partitions = 1 << PARTITION_BITS
+        self.spill_path = Path(tempfile.mkdtemp(prefix="___dedup_", dir=spill_path))
+        self.dtypes = None
+        self.files = {}
+
+    @property
+    def max_rows(self):
+        return max(1, self.memory_limit // (BYTES_PER_VALUE * len(self.columns)))
+
+    def get_partition_path(self, partition):
+        return self.spill_path.joinpath(f"partition_{partition:02d}.bin")
+
+    def get_partitions(self, chunk):
+        hashes = pd.util.hash_pandas_object(chunk[self.columns], index=False).to_numpy()
+        # every recursion level takes the next bits of the same row hash
+        return ((hashes >> np.uint64(PARTITION_BITS * self.level)) & np.uint64(self.num_partitions - 1)).astype(np.int64)
+
+    def add(self, chunk):
+        if len(chunk) == 0:
+            return
+        if self.dtypes is None:
+            self.dtypes = [chunk[column].to_numpy().dtype for column in self.columns]
+            assert all(dtype.itemsize <= 8 for dtype in self.dtypes)
+        values = np.column_stack([chunk[column].to_numpy().astype(np.int64) for column in self.columns])
+        partitions = self.get_partitions(chunk)
+        order = np.argsort(partitions, kind="stable")
+        bounds = np.searchsorted(partitions[order], np.arange(self.num_partitions + 1))
+        for partition, (start, end) in enumerate(zip(bounds, bounds[1:])):
+            if start == end:
+                continue
+            if partition not in self.files:
+                self.files[partition] = open(self.get_partition_path(partition), "ab")
+            self.files[partition].write(values[order[start:end]].tobytes())
+
+    def iterate_partition_slices(self, partition):
+        path = self.get_partition_path(partition)
+        row_size = 8 * len(self.columns)
+        num_rows = path.stat().st_size // row_size
+        for offset in range(0, num_rows, self.max_rows):
+            values = np.fromfile(
+                path, dtype=np.int64, count=min(self.max_rows, num_rows - offset) * len(self.columns),
+                offset=offset * row_size
+            )
+            yield self.to_frame(values.reshape(-1, len(self.columns)))
+
+    def to_frame(self, values):
+        return pd.DataFrame({
+            column: values[:, ind].astype(dtype) for ind, (column, dtype) in enumerate(zip(self.columns, self.dtypes))
+        })
+
+    def iterate_partition(self, partition):
+        path = self.get_partition_path(partition)
+        num_rows = path.stat().st_size // (8 * len(self.columns))
+        if num_rows <= self.max_rows or self.level + 1 >= MAX_LEVEL:
+            data = np.fromfile(path, dtype=np.int64).reshape(-1, len(self.columns))
+            yield self.to_frame(data).drop_duplicates(self.columns)
+        else:
+            # the partition does not fit into memory, spread it over the next level of partitions
+            child = HashPartitionDeduplicator(self.columns, self.spill_path, self.memory_limit, self.level + 1)
+            try:
+                for data in self.iterate_partition_slices(partition):
+                    child.add(data)
+                yield from child
+            finally:
+                child.close()
+        path.unlink()
+
+    def __iter__(self):
+        for file in self.files.values():
+            file.close()
+        for partition in sorted(self.files):
+            yield from self.iterate_partition(partition)
+        self.files = {}
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+        shutil.rmtree(self.spill_path, ignore_errors=True)
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from dsa.data.SQLMapping import SQLMapping
+
+
+class IdDictionary(SQLMapping):
+    def __init__(self, db_conn, name):
+        # ids are allocated once and kept in the db, so an id keeps its int code across runs
+        # even when it disappears from a dump for a while. Keys are stored without a declared
+        # type, so that they come back with the type they were written with.
+        super().__init__(db_conn, f"id_dictionary_{name}", "key", "id")
+        self.name = name
+        self.conn.execute(f"create table if not exists {self.table_name} (key PRIMARY KEY, id INTEGER UNIQUE)")
+        self.conn.commit()
+
+    def get_next_id(self):
+        return self.conn.execute(f"SELECT COALESCE(MAX(id) + 1, 0) FROM {self.table_name}").fetchone()[0]
+
+    def allocate(self, ids):
+        # new ids get consecutive codes in one insert, known and missing ids are skipped
+        ids = pd.unique(pd.Series(np.asarray(ids, dtype=object)).dropna().to_numpy())
+        _, found = self.lookup_many(ids)
+        new_ids = ids[~found]
+        if len(new_ids) == 0:
+            return
+        next_id = self.get_next_id()
+        self.conn.executemany(
+            f"INSERT INTO {self.table_name} VALUES (?,?)", zip(new_ids.tolist(), range(next_id, next_id + len(new_ids)))
+        )
+        self.conn.commit()
+
+    def encode(self, ids):
+        # returns int codes and a mask of rows that could not be resolved, their codes are -1
+        values, found = self.lookup_many(ids)
+        codes = np.full(len(values), -1, dtype=np.int64)
+        codes[found] = values[found].astype(np.int64)
+        return pd.Series(codes, index=ids.index), pd.Series(~found, index=ids.index)
@@ -0,0 +1,18 @@
+import numpy as np
+import pandas as pd
+
+
+class IdEncoder:
+    def __init__(self, mapping):
+        # the mapping is frozen into an index of keys and an aligned array of codes,
+        # lookups are then a single get_indexer call for the whole column
+        self.index = pd.Index(list(mapping.keys()), dtype=object)
+        self.codes = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+
+    def encode(self, ids):
+        # returns int codes and a mask of rows that could not be resolved, their codes are -1
+        positions = self.index.get_indexer(np.asarray(ids, dtype=object))
+        unresolved = positions < 0
+        codes = np.full(len(positions), -1, dtype=np.int64)
+        codes[~unresolved] = self.codes[positions[~unresolved]]
+        return pd.Series(codes, index=ids.index), pd.Series(unresolved, index=ids.index)
@@ -0,0 +1,89 @@
+import json
+import logging
+from collections import OrderedDict
+
+
+class MaterializedTables:
+    def __init__(self, db, table_name="table_versions"):
+        # every table has a version from one counter. Base tables are versioned by the code that
+        # writes them, derived tables also keep the versions of their inputs from the last build
+        # and are rebuilt only when those differ
+        self.db = db
+        self.table_name = table_name
+        self.definitions = OrderedDict()
+        self.db.execute(
+            f"create table if not exists {self.table_name} (name TEXT PRIMARY KEY, version INTEGER, inputs TEXT)"
+        )
+
+    def get_version(self, name):
+        result = self.db.conn.execute(f"SELECT version FROM {self.table_name} WHERE name = ?", (name,)).fetchone()
+        return 0 if result is None else result[0]
+
+    def set_version(self, name, inputs=None):
+        # the counter only grows, a rebuilt table is always newer than everything it was built from
+        self.db.conn.execute(
+            f"REPLACE INTO {self.table_name} VALUES (?, (SELECT COALESCE(MAX(version), 0) + 1 FROM {self.table_name}), ?)",
+            (name, inputs)
+        )
+        self.db.conn.commit()
+
+    def bump(self, name):
+        self.set_version(name)
+
+    def define(self, name, build, inputs=(), parameters=None):
+        # build is a SELECT the table is created from, or a function that writes the table itself,
+        # parameters are values other than tables that the content depends on
+        self.definitions[name] = (build, tuple(inputs), parameters or {})
+
+    def get_signature(self, name):
+        _, inputs, parameters = self.definitions[name]
+        return json.dumps(
+            {"inputs": {input_: self.get_version(input_) for input_ in inputs}, "parameters": parameters},
+            sort_keys=True, default=str
+        )
+
+    def get_inputs(self, name):
+        # inputs recorded by the last set_version of the table
+        result = self.db.conn.execute(f"SELECT inputs FROM {self.table_name} WHERE name = ?", (name,)).fetchone()
+        return None if result is None else result[0]
+
+    def is_stale(self, name):
+        if name not in self.db.get_table_names():
+            return True
+        return self.get_inputs(name) != self.get_signature(name)
+
+    def get_build_order(self, names):
+        order = []
+        visiting = set()
+
+        def visit(name):
+            if name in order or name not in self.definitions:
+                return
+            if name in visiting:
+                raise ValueError(f"Cyclic dependency through {name}")
+            visiting.add(name)
+            for input_ in self.definitions[name][1]:
+                visit(input_)
+            visiting.remove(name)
+            order.append(name)
+
+        for name in names:
+            visit(name)
+        return order
+
+    def refresh(self, names=None):
+        # builds stale tables among the given ones and their defined inputs, upstream first
+        rebuilt = []
+        for name in self.get_build_order(self.definitions if names is None else names):
+            if not self.is_stale(name):
+                continue
+            logging.info(f"Building {name}")
+            build = self.definitions[name][0]
+            self.db.drop_table(name)
+            if callable(build):
+                build()
+            else:
+                self.db.execute(f"CREATE TABLE {name} AS {build}")
+            self.set_version(name, self.get_signature(name))
+            rebuilt.append(name)
+        return rebuilt
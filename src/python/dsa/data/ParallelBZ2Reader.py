@@ -0,0 +1,186 @@
+import bz2
+import io
+import mmap
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+BLOCK_MAGIC = 0x314159265359
+STREAM_END_MAGIC = 0x177245385090
+MAGIC_BITS = 48
+CRC_BITS = 32
+
+BZ2Block = namedtuple("BZ2Block", ["start_bit", "end_bit", "crc"])
+
+
+def shifted_magic_patterns(magic):
+    # bz2 blocks are not byte aligned, so for every bit shift of the magic we search
+    # for the bytes it fully covers and check the partially covered edge bytes separately
+    patterns = []
+    for shift in range(8):
+        window = (magic << (8 - shift)).to_bytes(7, "big")
+        if shift == 0:
+            patterns.append((shift, window[:6], None, None))
+        else:
+            head_mask = (1 << (8 - shift)) - 1
+            tail_mask = (0xFF << (8 - shift)) & 0xFF
+            patterns.append((shift, window[1:6], (head_mask, window[0]), (tail_mask, window[6])))
+    return patterns
+
+
+def find_magic(data, magic):
+    positions = []
+    for shift, needle, head, tail in shifted_magic_patterns(magic):
+        needle_offset = 0 if shift == 0 else 1
+        position = data.find(needle, needle_offset)
+        while position != -1:
+            byte_start = position - needle_offset
+            valid = True
+            if head is not None:
+                mask, value = head
+                valid = (data[byte_start] & mask) == (value & mask)
+            if valid and tail is not None:
+                mask, value = tail
+                tail_position = byte_start + 6
+                valid = tail_position < len(data) and (data[tail_position] & mask) == (value & mask)
+            if valid:
+                positions.append(byte_start * 8 + shift)
+            position = data.find(needle, position + 1)
+    return positions
+
+
+def read_bits(data, start_bit, end_bit):
+    byte_start = start_bit // 8
+    byte_end = (end_bit + 7) // 8
+    value = int.from_bytes(data[byte_start:byte_end], "big")
+    value >>= byte_end * 8 - end_bit
+    return value & ((1 << (end_bit - start_bit)) - 1)
+
+
+def index_bz2_blocks(data):
+    markers = sorted(
+        [(position, True) for position in find_magic(data, BLOCK_MAGIC)] +
+        [(position, False) for position in find_magic(data, STREAM_END_MAGIC)]
+    )
+    blocks = []
+    for (position, is_block), (next_position, _) in zip(markers, markers[1:]):
+        if is_block:
+            crc = read_bits(data, position + MAGIC_BITS, position + MAGIC_BITS + CRC_BITS)
+            blocks.append(BZ2Block(position, next_position, crc))
+    return blocks
+
+
+def decompress_blocks(data, blocks):
+    # a run of blocks from one stream is re-wrapped into a standalone stream: header, the original
+    # block bits, end-of-stream magic and the combined crc computed from the block crcs
+    combined_crc = 0
+    for block in blocks:
+        combined_crc = (((combined_crc << 1) | (combined_crc >> 31)) & 0xFFFFFFFF) ^ block.crc
+    start_bit, end_bit = blocks[0].start_bit, blocks[-1].end_bit
+    stream_bits = end_bit - start_bit + MAGIC_BITS + CRC_BITS
+    stream = (read_bits(data, start_bit, end_bit) << (MAGIC_BITS + CRC_BITS)) | \
+        (STREAM_END_MAGIC << CRC_BITS) | combined_crc
+    padding = -stream_bits % 8
+    return bz2.decompress(b"BZh9" + (stream << padding).to_bytes((stream_bits + padding) // 8, "big"))
+
+
+def decompress_merged(data, blocks, first, max_merged=4):
+    # a false magic match inside block data splits a real block, and the truncated parts
+    # fail to decompress, so the failed block is retried extended over the following markers
+    candidates = []
+    for index in range(first + 1, min(first + 1 + max_merged, len(blocks))):
+        candidates.append((blocks[index].start_bit, index - 1))
+        candidates.append((blocks[index].end_bit, index))
+    for end_bit, last in candidates:
+        try:
+            return decompress_blocks(data, [blocks[first]._replace(end_bit=end_bit)]), last
+        except (OSError, ValueError):
+            continue
+    raise OSError(f"Corrupted bz2 block at bit {blocks[first].start_bit}")
+
+
+def iterate_blocks(data, blocks, start, end):
+    index = start
+    while index < end:
+        try:
+            yield decompress_blocks(data, [blocks[index]])
+        except (OSError, ValueError):
+            content, index = decompress_merged(data, blocks, index)
+            yield content
+        index += 1
+
+
+class IteratorReader(io.RawIOBase):
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self.buffer) == 0:
+            try:
+                self.buffer = memoryview(next(self.pieces))
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self.buffer))
+        buffer[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.pieces.close()
+        super().close()
+
+
+class ParallelBZ2Reader(IteratorReader):
+    def __init__(self, path, threads=None, size=None):
+        self.path = path
+        self.threads = threads or os.cpu_count() or 1
+        self.file = open(path, "rb")
+        if size is None:
+            size = os.fstat(self.file.fileno()).st_size
+        if size > 0:
+            self.data = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+            self.blocks = index_bz2_blocks(self.data)
+        else:
+            self.data = None
+            self.blocks = []
+        self.executor = ThreadPoolExecutor(self.threads)
+        super().__init__(self.iterate_decompressed())
+
+    def iterate_decompressed(self):
+        in_flight = deque()
+        next_block = 0
+        skip_until = 0
+        while next_block < len(self.blocks) or in_flight:
+            while next_block < len(self.blocks) and len(in_flight) < self.threads * 2:
+                in_flight.append((next_block, self.executor.submit(
+                    decompress_blocks, self.data, [self.blocks[next_block]]
+                )))
+                next_block += 1
+            index, future = in_flight.popleft()
+            if index < skip_until:
+                future.cancel()
+                continue
+            try:
+                yield future.result()
+            except (OSError, ValueError):
+                content, last = decompress_merged(self.data, self.blocks, index)
+                skip_until = last + 1
+                yield content
+
+    def close(self):
+        if not self.closed:
+            self.pieces.close()
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            if self.data is not None:
+                self.data.close()
+            self.file.close()
+        super().close()
+
+
+def open_parallel_bz2(path, threads=None, size=None):
+    return io.BufferedReader(ParallelBZ2Reader(path, threads=threads, size=size), buffer_size=1 << 20)
@@ -0,0 +1,113 @@
+import json
+import os
+import shutil
+import zlib
+from collections import namedtuple
+
+CHECKSUM_BLOCK = 16 * 1024 ** 2
+
+# committed state of a dump: the raw file is processed up to offset
+PartitionState = namedtuple("PartitionState", ["offset", "rows", "checksum"])
+# unfinished run over [start, end) of the raw file. For "chunks" runs, done holds [stream offset, rows]
+# for every committed chunk. For "ranges" runs, it maps finished range indices to their rows.
+# base_size is the dump size before the run, it tells if the finished output was already moved in place.
+PartitionProgress = namedtuple(
+    "PartitionProgress", ["kind", "start", "end", "checksum", "base_size", "num_ranges", "done"]
+)
+
+
+def prefix_checksum(path, offset):
+    # the whole processed prefix is hashed, a dump rewritten anywhere before the offset is processed
+    # again. It is one sequential read of the prefix, far cheaper than preprocessing it again
+    checksum = 0
+    with open(path, "rb") as file:
+        remaining = offset
+        while remaining > 0:
+            block = file.read(min(CHECKSUM_BLOCK, remaining))
+            if len(block) == 0:
+                break
+            checksum = zlib.crc32(block, checksum)
+            remaining -= len(block)
+    return checksum
+
+
+def replace_atomically(path, write_fn):
+    temp_path = path.with_name(path.name + ".tmp")
+    write_fn(temp_path)
+    os.replace(temp_path, path)
+
+
+class PartitionManifest:
+    def __init__(self, dump_path):
+        self.dump_path = dump_path
+        self.path = dump_path.with_name(dump_path.name + "___manifest.json")
+        self.chunks_path = dump_path.with_name(dump_path.name + "___chunks")
+
+    def load_content(self):
+        if not self.path.is_file():
+            return {"state": None, "progress": None}
+        with open(self.path, "r") as manifest:
+            return json.load(manifest)
+
+    def save_content(self, content):
+        def write(path):
+            with open(path, "w") as manifest:
+                json.dump(content, manifest)
+        replace_atomically(self.path, write)
+
+    def load(self):
+        state = self.load_content()["state"]
+        return None if state is None else PartitionState(**state)
+
+    def load_progress(self):
+        progress = self.load_content()["progress"]
+        return None if progress is None else PartitionProgress(**progress)
+
+    def save(self, state, progress=None):
+        self.save_content({
+            "state": None if state is None else state._asdict(),
+            "progress": None if progress is None else progress._asdict()
+        })
+
+    def save_progress(self, progress):
+        content = self.load_content()
+        content["progress"] = None if progress is None else progress._asdict()
+        self.save_content(content)
+
+    def delete(self):
+        if self.path.is_file():
+            self.path.unlink()
+
+    def get_status(self, source_path):
+        state = self.load()
+        if state is None or not self.dump_path.is_file():
+            return "rebuild", None
+        size = os.path.getsize(source_path)
+        if size < state.offset or prefix_checksum(source_path, state.offset) != state.checksum:
+            return "rebuild", None
+        if size == state.offset:
+            return "current", state
+        return "append", state
+
+    def get_resumable_progress(self, source_path, kind, start):
+        progress = self.load_progress()
+        if progress is None or progress.kind != kind or progress.start != start:
+            return None
+        if os.path.getsize(source_path) < progress.end or \
+                prefix_checksum(source_path, progress.end) != progress.checksum:
+            return None
+        return progress
+
+    def get_base_size(self):
+        return self.dump_path.stat().st_size if self.dump_path.is_file() else None
+
+    def is_output_in_place(self, progress):
+        # the finished output replaces the dump with a rename, so a dump that differs
+        # from the one the run started with means only the manifest update is missing
+        return self.get_base_size() != progress.base_size
+
+    def get_chunk_path(self, index, suffix):
+        return self.chunks_path.joinpath(f"{index:06d}{suffix}")
+
+    def clear_chunks(self):
+        shutil.rmtree(self.chunks_path, ignore_errors=True)
@@ -0,0 +1,170 @@
+import bz2
+import io
+import mmap
+import os
+from collections import namedtuple
+
+from dsa.data.ParallelBZ2Reader import IteratorReader, index_bz2_blocks, iterate_blocks
+
+MIN_RANGE_SIZE = 64 * 1024 ** 2
+READ_SIZE = 1024 ** 2
+
+# start and end are byte offsets for plain files and block numbers for bz2 files
+PartitionRange = namedtuple("PartitionRange", ["index", "header", "start", "end", "size", "blocks", "is_last"])
+
+
+def read_header(pieces):
+    header = b""
+    for piece in pieces:
+        newline = piece.find(b"\n")
+        if newline != -1:
+            return header + piece[:newline + 1]
+        header += piece
+    return header
+
+
+def iterate_file(file, start, end=None):
+    file.seek(start)
+    position = start
+    while end is None or position < end:
+        piece = file.read(READ_SIZE if end is None else min(READ_SIZE, end - position))
+        if len(piece) == 0:
+            break
+        position += len(piece)
+        yield piece
+
+
+def line_aligned(owned, following, skip_first_line):
+    # a range owns the lines that start after the first newline at or after its start offset,
+    # the preceding range reads past its end up to that same newline
+    if skip_first_line:
+        for piece in owned:
+            newline = piece.find(b"\n")
+            if newline != -1:
+                yield piece[newline + 1:]
+                break
+        else:
+            return
+    yield from owned
+    for piece in following:
+        newline = piece.find(b"\n")
+        if newline != -1:
+            yield piece[:newline + 1]
+            return
+        yield piece
+
+
+def is_bz2(path):
+    return str(path).endswith(".bz2")
+
+
+def get_processable_end(path):
+    # a growing plain file may end with a partially written line, it is left for the next run
+    size = os.path.getsize(path)
+    if is_bz2(path):
+        return size
+    with open(path, "rb") as file:
+        end = size
+        while end > 0:
+            start = max(0, end - READ_SIZE)
+            newline = read_window(file, start, end).rfind(b"\n")
+            if newline != -1:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+def read_window(file, start, end):
+    file.seek(start)
+    return file.read(end - start)
+
+
+def is_bz2_stream_start(path, offset):
+    with open(path, "rb") as file:
+        return read_window(file, offset, offset + 3) == b"BZh"
+
+
+def read_file_header(path):
+    with (bz2.open(path, "rb") if is_bz2(path) else open(path, "rb")) as file:
+        return file.readline()
+
+
+def get_range_count(path, max_ranges):
+    return max(1, min(max_ranges, os.path.getsize(path) // MIN_RANGE_SIZE))
+
+
+def split_plain_file(path, num_ranges, size):
+    with open(path, "rb") as file:
+        header = read_header(iterate_file(file, 0))
+    bounds = [size * ind // num_ranges for ind in range(num_ranges + 1)]
+    return [
+        PartitionRange(ind, header, start, end, end - start, None, ind == num_ranges - 1)
+        for ind, (start, end) in enumerate(zip(bounds, bounds[1:]))
+    ]
+
+
+def split_bz2_file(path, num_ranges):
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        blocks = tuple(index_bz2_blocks(data))
+        header = read_header(iterate_blocks(data, blocks, 0, len(blocks)))
+    num_ranges = max(1, min(num_ranges, len(blocks)))
+    bounds = [len(blocks) * ind // num_ranges for ind in range(num_ranges + 1)]
+    return [
+        PartitionRange(
+            ind, header, start, end, (blocks[end - 1].end_bit - blocks[start].start_bit) // 8, blocks,
+            ind == num_ranges - 1
+        )
+        for ind, (start, end) in enumerate(zip(bounds, bounds[1:]))
+    ]
+
+
+def split_partition(path, num_ranges, end):
+    if end == 0:
+        return []
+    if is_bz2(path):
+        return split_bz2_file(path, num_ranges)
+    else:
+        return split_plain_file(path, num_ranges, end)
+
+
+def iterate_range(path, partition_range):
+    skip_first_line = partition_range.index > 0
+    if skip_first_line:
+        yield partition_range.header
+    with open(path, "rb") as file:
+        if partition_range.blocks is None:
+            owned = iterate_file(file, partition_range.start, partition_range.end)
+            # the last range ends at a line boundary and must not read lines appended after it
+            following = iter(()) if partition_range.is_last else iterate_file(file, partition_range.end)
+            yield from line_aligned(owned, following, skip_first_line)
+        else:
+            blocks = partition_range.blocks
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                owned = iterate_blocks(data, blocks, partition_range.start, partition_range.end)
+                following = iterate_blocks(data, blocks, partition_range.end, len(blocks))
+                yield from line_aligned(owned, following, skip_first_line)
+
+
+def open_partition_range(path, partition_range):
+    return io.BufferedReader(IteratorReader(iterate_range(path, partition_range)), buffer_size=READ_SIZE)
+
+
+def iterate_tail(path, start, end, header):
+    if start > 0:
+        yield header
+    with open(path, "rb") as file:
+        if is_bz2(path):
+            # appended data starts with a new bz2 stream, BZ2File reads all streams up to the end
+            with bz2.open(IteratorReader(iterate_file(file, start, end)), "rb") as tail:
+                while True:
+                    piece = tail.read(READ_SIZE)
+                    if len(piece) == 0:
+                        break
+                    yield piece
+        else:
+            yield from iterate_file(file, start, end)
+
+
+def open_partition_tail(path, start, end):
+    header = read_file_header(path) if start > 0 else b""
+    return io.BufferedReader(IteratorReader(iterate_tail(path, start, end, header)), buffer_size=READ_SIZE)
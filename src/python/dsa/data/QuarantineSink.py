@@ -0,0 +1,81 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class QuarantineSink:
+    def __init__(self, path, db_conn, run_id, table_name="quarantine_counts", batch_size=100000):
+        # rejected rows of a run keep their own columns and get the source and reason columns, rows of
+        # one schema form a parquet dataset under quarantine/<run_id>/, where every process appends
+        # to its own file. The number of rows per reason is kept in the db
+        self.path = path.joinpath("quarantine", run_id)
+        self.conn = db_conn
+        self.run_id = run_id
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.writers = {}
+        self.buffers = {}
+        self.buffered_rows = 0
+        self.conn.execute(
+            f"create table if not exists {self.table_name} (run_id TEXT, source TEXT, reason TEXT, rows INTEGER, "
+            f"PRIMARY KEY (run_id, source, reason))"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def to_table(rows, reasons, source):
+        # text columns are stored as strings, values of mixed types in them would not convert
+        rows = rows.reset_index(drop=True)
+        for column in rows.columns[(rows.dtypes == object).to_numpy()]:
+            rows[column] = rows[column].astype("string")
+        rows["source"] = pd.Series(str(source), index=rows.index, dtype="string")
+        rows["reason"] = pd.Series(reasons, index=rows.index, dtype="string")
+        table = pa.Table.from_pandas(rows, preserve_index=False)
+        return table.replace_schema_metadata()
+
+    @staticmethod
+    def get_dataset_name(schema):
+        return hashlib.sha1(schema.to_string().encode("utf-8")).hexdigest()[:12]
+
+    def add(self, rows, reasons, source):
+        # reasons is a single code or one code per row
+        if len(rows) == 0:
+            return
+        reasons = np.broadcast_to(np.asarray(reasons, dtype=object), (len(rows),))
+        table = self.to_table(rows, reasons, source)
+        self.buffers.setdefault(self.get_dataset_name(table.schema), []).append(table)
+        self.buffered_rows += len(rows)
+        self.count(source, reasons)
+        if self.buffered_rows >= self.batch_size:
+            self.flush()
+
+    def count(self, source, reasons):
+        codes, counts = np.unique(reasons.astype(str), return_counts=True)
+        self.conn.executemany(
+            f"INSERT INTO {self.table_name} VALUES (?,?,?,?) "
+            f"ON CONFLICT (run_id, source, reason) DO UPDATE SET rows = rows + excluded.rows",
+            [(self.run_id, str(source), code, int(count)) for code, count in zip(codes, counts)]
+        )
+        self.conn.commit()
+
+    def flush(self):
+        for name, tables in self.buffers.items():
+            if name not in self.writers:
+                dataset_path = self.path.joinpath(name)
+                dataset_path.mkdir(parents=True, exist_ok=True)
+                self.writers[name] = pq.ParquetWriter(
+                    dataset_path.joinpath(f"part-{os.getpid()}.parquet"), tables[0].schema
+                )
+            self.writers[name].write_table(pa.concat_tables(tables))
+        self.buffers = {}
+        self.buffered_rows = 0
+
+    def close(self):
+        self.flush()
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
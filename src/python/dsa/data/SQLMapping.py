@@ -0,0 +1,115 @@
+import sqlite3
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+class SQLMapping:
+    def __init__(self, db_conn, table_name, key_column, value_column, cache_size=100000):
+        # dict-like view of two columns of a table, single lookups go through a bounded lru cache
+        # and batches through lookup_many, nothing is loaded up front. The key column must be unique,
+        # update relies on it. A table that does not exist yet reads as empty
+        self.conn = db_conn
+        self.table_name = table_name
+        self.key_column = key_column
+        self.value_column = value_column
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def __getstate__(self):
+        # the connection stays with the process that opened it, see SharedModel.__setstate__
+        state = self.__dict__.copy()
+        state.pop("conn")
+        state["cache"] = OrderedDict()
+        return state
+
+    def read(self, query, parameters=()):
+        try:
+            return self.conn.execute(query, parameters).fetchall()
+        except sqlite3.OperationalError as e:
+            if "no such table" not in str(e):
+                raise
+            return []
+
+    def remember(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def __getitem__(self, key):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        result = self.read(f"SELECT {self.value_column} FROM {self.table_name} WHERE {self.key_column} = ?", (key,))
+        if len(result) == 0:
+            raise KeyError(f"Key {key} not in table")
+        self.remember(key, result[0][0])
+        return result[0][0]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, mapping):
+        items = [(key, value) for key, value in dict(mapping).items()]
+        # other columns of existing rows are kept, REPLACE would reinsert the row without them
+        self.conn.executemany(
+            f"INSERT INTO {self.table_name} ({self.key_column}, {self.value_column}) VALUES (?,?) "
+            f"ON CONFLICT ({self.key_column}) DO UPDATE SET {self.value_column} = excluded.{self.value_column}",
+            items
+        )
+        self.conn.commit()
+        for key, value in items:
+            if key in self.cache:
+                self.remember(key, value)
+
+    def __len__(self):
+        result = self.read(f"SELECT COUNT(*) FROM {self.table_name}")
+        return 0 if len(result) == 0 else result[0][0]
+
+    def items(self):
+        return iter(self.read(f"SELECT {self.key_column}, {self.value_column} FROM {self.table_name}"))
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def lookup_many(self, keys):
+        # resolves a batch with one join against a temporary table of the distinct keys,
+        # returns the values and a mask of keys that were found
+        keys = pd.Series(np.asarray(keys, dtype=object))
+        codes, uniques = pd.factorize(keys)
+        # one extra slot at the end for missing keys, their code is -1
+        values = np.full(len(uniques) + 1, None, dtype=object)
+        found = np.zeros(len(uniques) + 1, dtype=bool)
+        if len(uniques) > 0:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_keys (position INTEGER PRIMARY KEY, key)")
+            self.conn.execute("DELETE FROM temp.lookup_keys")
+            self.conn.executemany(
+                "INSERT INTO temp.lookup_keys VALUES (?,?)", zip(range(len(uniques)), uniques.tolist())
+            )
+            result = self.read(
+                f"SELECT lookup_keys.position, {self.table_name}.{self.value_column} FROM temp.lookup_keys "
+                f"JOIN {self.table_name} ON {self.table_name}.{self.key_column} = lookup_keys.key"
+            )
+            self.conn.execute("DELETE FROM temp.lookup_keys")
+            self.conn.commit()
+            if len(result) > 0:
+                positions, result_values = zip(*result)
+                positions = np.fromiter(positions, dtype=np.int64, count=len(result))
+                values[positions] = np.array(result_values, dtype=object)
+                found[positions] = True
+        return values[codes], found[codes]
@@ -2,17 +2,34 @@ import sqlite3
 
 import pandas as pd
 
+from dsa.data.UuidCodec import encode_uuids, decode_uuids
+
 
 class SQLTable:
-    def __init__(self, filename):
-        self.conn = sqlite3.connect(filename)
+    def __init__(self, filename, timeout=3600):
+        # adapters write from several processes, a writer waits for the lock instead of failing
+        self.conn = sqlite3.connect(filename, timeout=timeout)
         self.path = filename
 
-    def replace_records(self, table, table_name, **kwargs):
+    @staticmethod
+    def encode_uuid_columns(table, uuid_columns):
+        if len(uuid_columns) == 0:
+            return table
+        return table.assign(**{column: encode_uuids(table[column]) for column in uuid_columns})
+
+    @staticmethod
+    def decode_uuid_columns(table, uuid_columns):
+        for column in uuid_columns:
+            table[column] = decode_uuids(table[column])
+        return table
+
+    def replace_records(self, table, table_name, uuid_columns=(), **kwargs):
+        table = self.encode_uuid_columns(table, uuid_columns)
         table.to_sql(table_name, con=self.conn, if_exists='replace', index=False, method="multi", chunksize=1000, **kwargs)
         self.create_index_for_table(table, table_name)
 
-    def add_records(self, table, table_name, **kwargs):
+    def add_records(self, table, table_name, uuid_columns=(), **kwargs):
+        table = self.encode_uuid_columns(table, uuid_columns)
         table.to_sql(table_name, con=self.conn, if_exists='append', index=False, method="multi", chunksize=1000, **kwargs)
         self.create_index_for_table(table, table_name)
 
@@ -24,13 +41,33 @@ class SQLTable:
             """
         )
 
-    def query(self, query_string, **kwargs):
-        return pd.read_sql(query_string, self.conn, **kwargs)
+    def query(self, query_string, uuid_columns=(), **kwargs):
+        # uuid columns are stored as blobs and come back as strings
+        result = pd.read_sql(query_string, self.conn, **kwargs)
+        if len(uuid_columns) == 0:
+            return result
+        if isinstance(result, pd.DataFrame):
+            return self.decode_uuid_columns(result, uuid_columns)
+        return (self.decode_uuid_columns(chunk, uuid_columns) for chunk in result)
 
     def execute(self, query_string):
         self.conn.execute(query_string)
         self.conn.commit()
 
+    def delete_records(self, table_name, column, values, uuid_columns=()):
+        if table_name not in self.get_table_names():
+            return
+        if column in uuid_columns:
+            values = encode_uuids(values)
+        # keys go through a scratch table, a long IN (...) list would hit the sqlite variable limit
+        pd.DataFrame({column: values}).to_sql("delete_keys", con=self.conn, if_exists='replace', index=False)
+        self.conn.execute(f"DELETE FROM {table_name} WHERE {column} IN (SELECT {column} FROM delete_keys)")
+        self.conn.execute("DROP TABLE delete_keys")
+        self.conn.commit()
+
+    def get_table_names(self):
+        return [name for name, in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+
     def drop_table(self, table_name):
         self.conn.execute(f"DROP TABLE IF EXISTS {table_name}")
         self.conn.execute(f"DROP INDEX IF EXISTS idx_{table_name}")
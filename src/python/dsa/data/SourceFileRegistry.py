@@ -0,0 +1,33 @@
+from pathlib import Path
+
+
+class SourceFileRegistry:
+    def __init__(self, db_conn, table_name="statistics_source_files"):
+        # statistics rows carry the id of the file they came from, so a changed file replaces only its own rows
+        self.table_name = table_name
+        self.conn = db_conn
+        self.conn.execute(
+            f"create table if not exists {self.table_name} "
+            f"(file_id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT UNIQUE NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get_id(self, path):
+        filename = str(Path(path).absolute())
+        self.conn.execute(f"INSERT OR IGNORE INTO {self.table_name} (filename) VALUES (?)", (filename,))
+        self.conn.commit()
+        return self.conn.execute(
+            f"SELECT file_id FROM {self.table_name} WHERE filename = ?", (filename,)
+        ).fetchone()[0]
+
+    def get_files_in(self, directory):
+        directory = Path(directory).absolute()
+        return {
+            Path(filename): file_id
+            for filename, file_id in self.conn.execute(f"SELECT filename, file_id FROM {self.table_name}")
+            if Path(filename).parent == directory
+        }
+
+    def remove(self, file_id):
+        self.conn.execute(f"DELETE FROM {self.table_name} WHERE file_id = ?", (file_id,))
+        self.conn.commit()
@@ -0,0 +1,49 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from dsa.data.DumpReader import read_dump, DUMP_SCHEMAS
+
+
+class TableDumpCache:
+    def __init__(self, path, get_fingerprint):
+        # parsed dumps are kept as parquet files named by the content fingerprint of the dump and
+        # the read options, a dump that did not change is loaded from its typed copy.
+        # get_fingerprint is FileVersionStore.get_fingerprint, which remembers fingerprints for the run
+        self.path = Path(path)
+        self.get_fingerprint = get_fingerprint
+
+    @staticmethod
+    def get_options_key(args, kwargs):
+        # a declared schema is part of the key, copies typed by its older version are not served
+        options = (args, sorted(kwargs.items()), DUMP_SCHEMAS.get(kwargs.get("schema")))
+        return hashlib.sha1(repr(options).encode("utf-8")).hexdigest()[:16]
+
+    def read(self, path, *args, **kwargs):
+        path = Path(path)
+        if "chunksize" in kwargs or "iterator" in kwargs:
+            return read_dump(path, *args, **kwargs)
+        prefix = f"{path.name}.{self.get_options_key(args, kwargs)}"
+        stat = path.stat()
+        fingerprint = self.get_fingerprint(path, stat.st_size, stat.st_mtime_ns)
+        cached_path = self.path.joinpath(f"{prefix}.{fingerprint}.parquet")
+        if cached_path.is_file():
+            return pd.read_parquet(cached_path)
+
+        data = read_dump(path, *args, **kwargs)
+        self.path.mkdir(parents=True, exist_ok=True)
+        for outdated in self.path.glob(f"{prefix}.*.parquet"):
+            outdated.unlink(missing_ok=True)
+        # written under a temporary name, a reader in another thread never sees a partial file
+        temporary_path = cached_path.with_name(f"{cached_path.name}.{os.getpid()}.tmp")
+        try:
+            data.to_parquet(temporary_path, index=False)
+            os.replace(temporary_path, cached_path)
+        except (ValueError, TypeError, ImportError) as e:
+            # columns of mixed types can not be stored, such dumps are parsed every time
+            logging.warning(f"Dump {path.name} is not cached: {e}")
+            temporary_path.unlink(missing_ok=True)
+        return data
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# canonical lowercase uuids are stored as 16 byte blobs, other ids are left as they are,
+# so the conversion round trips for any id column
+UUID_PATTERN = r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+HYPHENS = [8, 13, 18, 23]
+DIGITS = [ind for ind in range(36) if ind not in HYPHENS]
+HEX_CHARS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+HEX_VALUES = np.zeros(256, dtype=np.uint8)
+HEX_VALUES[HEX_CHARS] = np.arange(16, dtype=np.uint8)
+
+
+def encode_uuids(ids):
+    ids = pd.Series(np.asarray(ids, dtype=object))
+    result = ids.to_numpy(dtype=object, copy=True)
+    candidates = ids.str.fullmatch(UUID_PATTERN, na=False).to_numpy(dtype=bool)
+    if not candidates.any():
+        return result
+    chars = np.frombuffer("".join(ids[candidates]).encode("ascii"), dtype=np.uint8).reshape(-1, 36)
+    nibbles = HEX_VALUES[chars[:, DIGITS]]
+    raw = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+    result[candidates] = pa.Array.from_buffers(
+        pa.binary(16), len(raw), [None, pa.py_buffer(raw.tobytes())]
+    ).to_numpy(zero_copy_only=False)
+    return result
+
+
+def decode_uuids(values):
+    result = np.asarray(values, dtype=object).copy()
+    # uuid columns normally hold only blobs and nulls, columns of other ids hold none,
+    # elements are checked one by one only for columns that mix both
+    kind = pd.api.types.infer_dtype(result, skipna=True)
+    if kind == "bytes":
+        blobs = ~pd.isna(result)
+    elif kind.startswith("mixed"):
+        blobs = np.fromiter((isinstance(value, bytes) for value in result), dtype=bool, count=len(result))
+    else:
+        return result
+    if not blobs.any():
+        return result
+    raw = np.frombuffer(b"".join(result[blobs]), dtype=np.uint8).reshape(-1, 16)
+    chars = np.empty((len(raw), 36), dtype=np.uint8)
+    chars[:, HYPHENS] = ord("-")
+    digits = np.empty((len(raw), 32), dtype=np.uint8)
+    digits[:, 0::2] = HEX_CHARS[raw >> 4]
+    digits[:, 1::2] = HEX_CHARS[raw & 15]
+    chars[:, DIGITS] = digits
+    result[blobs] = chars.view("S36").ravel().astype("U36").astype(object)
+    return result
@@ -0,0 +1,26 @@
+from importlib import import_module
+
+# every platform adapter has its own module, imported only when the adapter is selected,
+# the keys are the names accepted by --adapters
+ADAPTERS = {
+    "united": ("dsa.data.adapters.DataAdapter_United", "DataAdapter_United"),
+    "foxford": ("dsa.data.adapters.DataAdapter_FoxFord", "DataAdapter_FoxFord"),
+    "meo": ("dsa.data.adapters.DataAdapter_MEO", "DataAdapter_MEO"),
+    "uchi": ("dsa.data.adapters.DataAdapter_Uchi", "DataAdapter_Uchi"),
+}
+
+
+def get_adapter_class(name):
+    if name not in ADAPTERS:
+        raise ValueError(f"Unknown adapter {name}, expected one of {', '.join(ADAPTERS)}")
+    module_name, class_name = ADAPTERS[name]
+    return getattr(import_module(module_name), class_name)
+
+
+def ingest_adapter_statistics(adapter):
+    # runs in a worker process, the adapter brings a copy of the shared model with its own db connection
+    try:
+        adapter.ingest_statistics()
+    finally:
+        adapter.shared_model.quarantine.close()
+    return adapter.has_new_data
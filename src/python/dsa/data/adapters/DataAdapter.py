@@ -1,12 +1,27 @@
+import hashlib
+import json
 import logging
 from abc import abstractmethod
+from collections import namedtuple
 from math import isnan
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 
-from dsa.data.adapters.StatisticsCombiner import preprocess, map_partitions_1c_nd, map_partitions_foxford, \
-    map_partitions_meo, map_partitions_uchi
+from dsa.data.CourseIdCanonicalizer import CourseIdCanonicalizer
+from dsa.data.CourseAncestry import CourseAncestry
+from dsa.data.CourseTree import find_tops, find_descendants
+from dsa.data.DateIndex import to_day_index, day_index
+from dsa.data.HashPartitionDeduplicator import HashPartitionDeduplicator
+from dsa.data.IdEncoder import IdEncoder
+from dsa.data.SourceFileRegistry import SourceFileRegistry
+from dsa.data.adapters.StatisticsCombiner import preprocess, map_partitions_1c_nd, PREPROCESSED_SUFFIXES
+
+# courses holds the resolved rows of course_information that have to be written again,
+# nodes and ancestry are the changes for the stored course structure (None when it is not tracked)
+StructureUpdate = namedtuple("StructureUpdate", ["courses", "removed_ids", "nodes", "ancestry"])
 
 
 class DataAdapter:
@@ -18,12 +33,11 @@ class DataAdapter:
         self.shared_model = shared_model
         self.has_new_data = False
         self.args = args
-
-        self.load_course_structure(self.get_course_structure_path(args))
-        self.preprocess(self.get_course_statistics_path(args))
         self.set_preprocessed_path(args)
-        self.load_course_statistics()
 
+    def ingest_statistics(self):
+        self.preprocess(self.get_course_statistics_path(self.args))
+        self.load_course_statistics()
 
     @staticmethod
     def get_course_structure_path(args):
@@ -43,9 +57,23 @@ class DataAdapter:
             (str(p.absolute()) for p in path.iterdir())
         ))
 
+    def get_combiner_options(self):
+        return {
+            "output_format": self.args.preprocessed_format,
+            "decompression_threads": self.args.decompression_threads
+        }
+
+    def preprocess_files(self, files, partition_fn):
+        preprocess(
+            files, partition_fn,
+            workers=self.args.preprocess_workers, memory_budget=self.args.preprocess_memory_budget,
+            split_partitions=self.args.split_partitions,
+            **self.get_combiner_options()
+        )
+
     def preprocess(self, path):
         files = self.get_raw_statistics_files(path)
-        preprocess(files, map_partitions_1c_nd)
+        self.preprocess_files(files, map_partitions_1c_nd)
 
     # @property
     # def db(self):
@@ -68,40 +96,109 @@ class DataAdapter:
         )
         return data
 
-    def validate_structure_id(self, id_, parent_id, structure):
-        assert id_ not in structure
-
-    def resolve_structure(self, data):
-        fields = data.columns
-        structure = {}
-        for ind, row in data.iterrows():
-            self.validate_structure_id(row["id"], row["parent_id"], structure)
-            structure[row["id"]] = {key: row[key] for key in fields}
-        self.structure = structure
-
-        mapping = []
-        for id_ in structure:
-            course_name, provider, is_deleted = self.find_subject(id_)
-            mapping.append({
-                "educational_course_id": id_,
-                "course_name": course_name,
-                "provider": provider,
-                "is_deleted": is_deleted
-            })
-        return pd.DataFrame(mapping)
+    def validate_structure_ids(self, data):
+        assert data["id"].is_unique
+
+    def canonicalize_parent_ids(self, data):
+        if pd.api.types.is_string_dtype(data["parent_id"]):
+            data["parent_id"] = CourseIdCanonicalizer(data["id"]).canonicalize(data["parent_id"])
+        return data
+
+    def describe_roots(self, roots):
+        course_names = roots["course_name"].tolist()
+        course_types = [self.get_course_type(type_id) for type_id in roots["course_type_id"]]
+        providers = [self.shared_model.external_system[system_code] for system_code in roots["system_code"]]
+        for course_name, course_type, provider in zip(course_names, course_types, providers):
+            self.validate_course(course_name, course_type, provider)
+        return pd.DataFrame({
+            "course_name": course_names, "provider": providers, "is_deleted": roots["is_deleted"].tolist()
+        }, dtype=object)
+
+    def get_course_ancestry(self):
+        return CourseAncestry(
+            self.shared_model.db, self.get_course_structure_table_name(), self.get_course_ancestry_table_name()
+        )
+
+    def get_structure_dependencies(self):
+        # course rows also depend on the billed course names, providers and course types,
+        # a change of any of them makes the whole structure resolve again
+        dumps = json.dumps({
+            "external_system": sorted(self.shared_model.external_system.items()),
+            "course_types": sorted(self.shared_model.course_types.items())
+        }, default=str)
+        return json.dumps({
+            "billing_info": self.shared_model.tables.get_version("billing_info"),
+            "dumps": hashlib.sha1(dumps.encode("utf-8")).hexdigest()
+        })
+
+    def get_described_ids(self):
+        db = self.shared_model.db
+        if "course_information" not in db.get_table_names():
+            return pd.Series([], dtype="string")
+        return db.query(
+            "SELECT educational_course_id_uuid FROM course_information", uuid_columns=["educational_course_id_uuid"]
+        )["educational_course_id_uuid"].astype("string")
+
+    def resolve_structure(self, data, full=False):
+        data = self.canonicalize_parent_ids(data)
+        self.validate_structure_ids(data)
+        data = data.drop_duplicates(subset=["id"], keep="last").reset_index(drop=True)
+        snapshot = CourseAncestry.make_snapshot(data)
+        ids = pd.Index(snapshot["id"].to_numpy(dtype=object))
+
+        # only nodes that changed since the previous dump and their subtrees are resolved again
+        ancestry = self.get_course_ancestry()
+        changed_ids, removed_ids = ancestry.diff(snapshot)
+        if full:
+            changed_ids = snapshot["id"].to_numpy(dtype=object)
+        else:
+            # nodes without a course row were dropped on an earlier run, e.g. because billing
+            # did not list their course yet, they are resolved again until they get one
+            undescribed = snapshot["id"][~snapshot["id"].isin(self.get_described_ids())]
+            changed_ids = pd.unique(np.concatenate([changed_ids, undescribed.to_numpy(dtype=object)]))
+        affected = np.flatnonzero(find_descendants(snapshot["id"], snapshot["parent_id"], changed_ids))
+        nodes = snapshot.iloc[affected]
+
+        tops = find_tops(nodes["id"], nodes["parent_id"])
+        top_ids = nodes["id"].to_numpy(dtype=object)[tops]
+        top_parents = nodes["parent_id"].to_numpy(dtype=object)[tops]
+        # a top node either is a root itself, or hangs under an unchanged node whose root is already stored
+        root_ids = np.where(
+            pd.isna(top_parents), top_ids,
+            np.where(ids.get_indexer(top_parents) >= 0, ancestry.get_roots(top_parents), None)
+        )
+
+        positions = ids.get_indexer(root_ids)
+        root_positions = pd.unique(positions[positions >= 0])
+        described = self.describe_roots(data.iloc[root_positions])
+        # nodes that are not attached to a known course get the empty row at the end
+        described.loc[len(described)] = [None, None, None]
+        rows = pd.Index(root_positions).get_indexer(positions)
+        rows[rows < 0] = len(root_positions)
+        courses = described.iloc[rows].reset_index(drop=True)
+        courses.insert(0, "educational_course_id", data["id"].to_numpy()[affected])
+
+        return StructureUpdate(
+            courses=courses, removed_ids=removed_ids,
+            nodes=snapshot[snapshot["id"].isin(changed_ids)],
+            ancestry=pd.DataFrame({"id": nodes["id"].to_numpy(dtype=object), "root_id": root_ids})
+        )
 
     def prepare_course_ids(self, data, path):
         self.shared_model.merge_provider_with_course_name(data)
         self.shared_model.convert_ids_to_int(data, ["educational_course_id"])
         self.shared_model.convert_ids_to_int(data, ["provider_course_name"], add_new=False)
         self.shared_model.check_for_nas(data, "provider_course_name", Path(str(path.absolute()) + f"_{self.__class__.__name__}"))
+        # educational_course_id2course_id reads course_information, which is written right after this
         data.rename({"provider_course_name": "course_id"}, axis=1, inplace=True)
-        self.shared_model.mappings["educational_course_id2course_id"].update(dict(zip(data["educational_course_id"], data["course_id"])))
 
         return data
 
     def load_course_structure(self, path):
-        if self.shared_model.is_new_version(path):
+        dependencies = self.get_structure_dependencies()
+        tables = self.shared_model.tables
+        dependencies_changed = tables.get_inputs(self.get_course_ancestry_table_name()) != dependencies
+        if self.shared_model.is_new_version(path) or dependencies_changed:
             data = self.shared_model.read_table_dump(path)
             data = self.format_course_structure_columns(data)
             if "is_deleted" in data.columns:
@@ -109,79 +206,43 @@ class DataAdapter:
             else:
                 data["is_deleted"] = False
             data = data.query("is_deleted == False")
-            data = self.resolve_structure(data)
-            data = self.prepare_course_ids(data, path)
-            # provider = next(iter(data["provider"]))
-            providers = data["provider"].unique()
-
-            try:
-                query_cond = " and ".join(f"provider != '{provider}'" for provider in providers)
-                existing = self.shared_model.db.query(
-                    f"""
-                    SELECT * from course_information where {query_cond}
-                    """
-                )
-            except:
-                existing = None
+            update = self.resolve_structure(data, full=dependencies_changed)
+            outdated_ids = np.concatenate([update.courses["educational_course_id"].to_numpy(dtype=object), update.removed_ids])
+            data = self.prepare_course_ids(update.courses, path)
+            self.update_course_information(data, outdated_ids)
+            if update.nodes is not None:
+                self.get_course_ancestry().save(update.nodes, update.ancestry, update.removed_ids)
+            tables.set_version(self.get_course_ancestry_table_name(), dependencies)
+            self.shared_model.save_current_file_version(path)
 
-            if existing is None:
-                to_write = data
-            else:
-                to_write = existing.append(data)
-
-            if existing is not None:
-                self.shared_model.db.drop_table("course_information_backup")
-                self.shared_model.db.execute("create table course_information_backup as select * from course_information")
-            self.shared_model.db.drop_table("course_information")
-
-            self.shared_model.db.replace_records(
-                to_write[[
-                    "educational_course_id", "educational_course_id_uuid",
-                    "course_name", "provider", "course_id", "is_deleted"]],
-                    "course_information",
+    def update_course_information(self, data, outdated_ids):
+        db = self.shared_model.db
+        columns = ["educational_course_id", "educational_course_id_uuid", "course_name", "provider", "course_id", "is_deleted"]
+        if "course_information" not in db.get_table_names():
+            db.replace_records(
+                data[columns], "course_information",
+                uuid_columns=["educational_course_id_uuid"],
                 dtype={
                     "educational_course_id": "INT PRIMARY KEY",
-                    "educational_course_id_uuid": "TEXT UNIQUE NOT NULL",
+                    "educational_course_id_uuid": "BLOB UNIQUE NOT NULL",
                     "course_name": "TEXT NOT NULL",
                     "provider": "TEXT NOT NULL",
                     "course_id": "INT NOT NULL",
                     "is_deleted": "INT NOT NULL"
                 }
             )
-            self.shared_model.save_current_file_version(path)
-
-    def remove_one_id_level(self, course_id):
-        return "/".join(course_id.split("/")[:-1])
+        else:
+            # rows of changed and removed nodes are replaced, the rest of the catalogue stays in place
+            db.delete_records(
+                "course_information", "educational_course_id_uuid", outdated_ids,
+                uuid_columns=["educational_course_id_uuid"]
+            )
+            db.add_records(data[columns], "course_information", uuid_columns=["educational_course_id_uuid"])
+        self.shared_model.tables.bump("course_information")
 
     def get_course_type(self, type_id):
         return self.shared_model.get_course_type(type_id)
 
-    def find_subject(self, course_id):
-        if not isinstance(course_id, float) and "foxford" in course_id and course_id not in self.structure:
-            course_id = self.remove_one_id_level(course_id)
-        if not isinstance(course_id, float) and course_id not in self.structure:
-            if f"Lesson_{course_id}" in self.structure:
-                course_id = f"Lesson_{course_id}"
-            elif f"Chapter_{course_id}" in self.structure:
-                course_id = f"Chapter_{course_id}"
-            elif f"Topic_{course_id}" in self.structure:
-                course_id = f"Topic_{course_id}"
-            elif f"Course_{course_id}" in self.structure:
-                course_id = f"Course_{course_id}"
-        if course_id not in self.structure:
-            return None, None, None
-        course = self.structure[course_id]
-        # print(course["course_name"], course_types[course["course_type_id"]], course["external_link"], sep="\t")
-        parent_id = course["parent_id"]
-        # print(parent_id, type(parent_id))
-        if isinstance(parent_id, float) and isnan(parent_id):                                   ###############ADD HERE
-            course_name = course["course_name"]
-            course_type = self.get_course_type(course["course_type_id"])
-            provider = self.shared_model.external_system[course["system_code"]]
-            self.validate_course(course_name, course_type, provider)
-            return course_name, provider, course["is_deleted"]
-        return self.find_subject(parent_id)
-
     def map_course_statistics_columns(self, data):
         pass
 
@@ -236,6 +297,14 @@ class DataAdapter:
         pass
         # return "active_days_count_unified"
 
+    @abstractmethod
+    def get_course_structure_table_name(self):
+        pass
+
+    @abstractmethod
+    def get_course_ancestry_table_name(self):
+        pass
+
     # def compute_active_days(self):
     #     if self.has_new_data:
     #         logging.info("Computing active days")
@@ -275,13 +344,39 @@ class DataAdapter:
 
     def get_freeze_date_filtration_rule(self):
         if self.args.freeze_date is not None:
-            return f"WHERE course_statistics.date < '{self.args.freeze_date}'"
+            return f"WHERE course_statistics.day < {day_index(self.args.freeze_date)}"
         else:
             return ""
 
     def load_course_statistics(self):
-        for chunk in self.iterate_preprocessed():
-            self.shared_model.db.add_records(chunk, self.get_statistics_table_name())
+        db = self.shared_model.db
+        source_files = SourceFileRegistry(db.conn)
+        files = list(self.get_preprocessed_files())
+        present = {file.absolute() for file in files}
+
+        # rows of preprocessed files that are gone are removed together with the files
+        for path, source_file in source_files.get_files_in(self.preprocessed_path).items():
+            if path not in present:
+                self.delete_source_file_records(source_file)
+                source_files.remove(source_file)
+                self.shared_model.version_store.delete(path.name)
+                self.has_new_data = True
+
+        profile_encoder, course_encoder = self.get_id_encoders()
+        canonicalizer = CourseIdCanonicalizer(course_encoder.index)
+        for file in files:
+            if self.shared_model.is_new_version(file):
+                source_file = source_files.get_id(file)
+                self.delete_source_file_records(source_file)
+                for chunk in self.iterate_preprocessed(file, canonicalizer, profile_encoder, course_encoder):
+                    chunk["source_file"] = source_file
+                    db.add_records(chunk, self.get_statistics_table_name())
+                self.shared_model.save_current_file_version(file)
+                self.has_new_data = True
+        if self.get_statistics_table_name() in db.get_table_names():
+            self.create_statistics_indexes()
+        if self.has_new_data:
+            self.shared_model.tables.bump(self.get_statistics_table_name())
 
         # self.compute_active_days()
         # self.compute_active_days_count()
@@ -329,228 +424,83 @@ class DataAdapter:
         assert isinstance(subject_name, str)
 
     def get_preprocessed_files(self):
-        return (file for file in self.preprocessed_path.iterdir() if file.name.endswith("___preprocessed.csv.bz2"))
-
-    def delete_if_needed(self):
-        pass
-
-    def iterate_preprocessed(self):
-        for file in self.get_preprocessed_files():
-            if self.shared_model.is_new_version(file):
-                self.delete_if_needed()
-                for chunk in pd.read_csv(
-                    file, chunksize=1000000,
-                    names=["profile_id", "educational_course_id", "created_at"], header=None,
-                    parse_dates=["created_at"], dtype={"educational_course_id": "string"}
-                ):
-                    def encode_course_id(id_):
-                        return self.shared_model.mappings["educational_course_id2course_id"].get(
-                            self.shared_model.mappings["educational_course_id"].get(id_, pd.NA),
-                            pd.NA
-                        )
-
-                    def encode_profile_id(id_):
-                        return self.shared_model.mappings["profile_id"].get(id_, pd.NA)
-
-                    chunk["educational_course_id"] = chunk["educational_course_id"].apply(encode_course_id)
-                    chunk["profile_id"] = chunk["profile_id"].apply(encode_profile_id)
-                    chunk.dropna(inplace=True)
-                    yield chunk
-                self.shared_model.save_current_file_version(file)
-                self.has_new_data = True
-
-    def __iter__(self):
-        return self.iterate_preprocessed()
-
-
-
-class DataAdapter_United(DataAdapter):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-    def delete_if_needed(self):
-        self.shared_model.db.drop_table(self.get_statistics_table_name())
-
-    def get_statistics_pre_table_name(self):
-        return "course_statistics_pre_unified"
-
-    def get_statistics_table_name(self):
-        return "course_statistics_unified"
-
-    def get_active_days_count_table_name(self):
-        return "active_days_count_unified"
-
-
-class DataAdapter_FoxFord(DataAdapter):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-    @staticmethod
-    def get_course_structure_path(args):
-        logging.info("Importing course statistics for FoxFord")
-        return Path(args.course_structure_foxford)
-
-    @staticmethod
-    def get_course_statistics_path(args):
-        return Path(args.course_statistics_foxford)
-
-    def preprocess(self, path):
-        files = self.get_raw_statistics_files(path)
-        preprocess(files, map_partitions_foxford)
-
-    def format_course_structure_columns(self, data):
-        data.rename({
-            "externalId": "id",
-            "externalParentId": "parent_id",
-            "courseName": "course_name",
-            "courseTypeId": "course_type_id",
-            "externalLink": "external_link"
-        }, axis=1, inplace=True)
-        data["system_code"] = "13788b9a-3426-45b2-9ba5-d8cec8c03c0c"
-        return data
-
-    def get_course_type(self, type_id):
-        if type_id == 0:
-            return "ЦОМ"
-        elif type_id == 2:
-            return "Урок"
-        elif type_id == 3:
-            return "Задача"
-        else:
-            raise ValueError()
-
-    def get_statistics_type(self, type_id):
-        if type_id == 0:
-            return  "login"
-        elif type_id == 2:
-            return "started_studying"
+        suffixes = tuple(PREPROCESSED_SUFFIXES.values())
+        return (file for file in self.preprocessed_path.iterdir() if file.name.endswith(suffixes))
+
+    def read_preprocessed_chunks(self, file):
+        column_order = ["profile_id", "educational_course_id", "created_at"]
+        if file.name.endswith(PREPROCESSED_SUFFIXES["parquet"]):
+            dump = pq.ParquetFile(file)
+            for batch in dump.iter_batches(batch_size=self.statistics_import_chunk_size, columns=column_order):
+                yield batch.to_pandas(date_as_object=False)
         else:
-            return "logout"
-
-    def validate_structure_id(self, id_, parent_id, structure):
-        if id_ in structure:
-            assert parent_id == structure[id_]["parent_id"]
+            yield from pd.read_csv(
+                file, chunksize=self.statistics_import_chunk_size,
+                names=column_order, header=None,
+                parse_dates=["created_at"], dtype={"educational_course_id": "string"}
+            )
 
-    def map_course_statistics_columns(self, data):
-        def normalize(id_):
-            if pd.isna(id_):
-                return id_
-            else:
-                return "/".join(id_.split("/")[:5])
-        data.eval(
-            "educational_course_id = educational_course_id.map(@normalize)",
-            local_dict={"normalize": normalize},
-            inplace=True
+    def create_statistics_indexes(self):
+        table_name = self.get_statistics_table_name()
+        db = self.shared_model.db
+        db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_source_file ON {table_name}(source_file)")
+        # rows are distinct only within a source file, the distinct rows of the whole table
+        # are read in the order of this index when course_statistics is built
+        db.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{table_name}_event ON {table_name}(profile_id, educational_course_id, day)"
         )
-        return data
-
-    # def get_statistics_pre_table_name(self):
-    #     return "course_statistics_pre_foxford"
-
-    def get_statistics_table_name(self):
-        return "course_statistics_foxford"
-
-    def get_active_days_count_table_name(self):
-        return "active_days_count_foxford"
-
-
-class DataAdapter_MEO(DataAdapter):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-    @staticmethod
-    def get_course_structure_path(args):
-        logging.info("Importing course statistics for MEO")
-        return Path(args.course_structure_meo)
-
-    @staticmethod
-    def get_course_statistics_path(args):
-        return Path(args.course_statistics_meo)
-
-    def preprocess(self, path):
-        files = self.get_raw_statistics_files(path)
-        preprocess(files, map_partitions_meo)
-
-    def format_course_structure_columns(self, data):
-        data.rename({"material_id": "educational_course_id"}, axis=1, inplace=True)
-        data["system_code"] = "61dbfd85-2f0b-49eb-ad60-343cc5f12a36"
-        return data.astype({"educational_course_id": "string"})
-
-    def map_course_statistics_columns(self, data):
-        # data.rename({
-        #     "Start": "created_at",
-        #     "profileId": "profile_id",
-        #     "CourseId": "educational_course_id",
-        # }, axis=1, inplace=True)
-        # data.astype({"educational_course_id": "Int64"}, inplace=True)
-        return data
-
-    def resolve_structure(self, data):
-        return data
-
-    # def get_statistics_pre_table_name(self):
-    #     return "course_statistics_pre_meo"
-
-    def get_statistics_table_name(self):
-        return "course_statistics_meo"
-
-    def get_active_days_count_table_name(self):
-        return "active_days_count_meo"
-
-
-class DataAdapter_Uchi(DataAdapter):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
 
-    @staticmethod
-    def get_course_structure_path(args):
-        logging.info("Importing course statistics UCHI")
-        return Path(args.course_structure_uchi)
-
-    @staticmethod
-    def get_course_statistics_path(args):
-        return Path(args.course_statistics_uchi)
-
-    def preprocess(self, path):
-        files = self.get_raw_statistics_files(path)
-        preprocess(files, map_partitions_uchi)
+    def delete_source_file_records(self, source_file):
+        table_name = self.get_statistics_table_name()
+        if table_name in self.shared_model.db.get_table_names():
+            self.shared_model.db.execute(f"DELETE FROM {table_name} WHERE source_file = {int(source_file)}")
 
-    def get_statistics_type(self, type_id):
-        if type_id == 0:
-            return "login"
-        elif type_id == 2:
-            return "started_studying"
-        else:
-            return "logout"
-
-    def format_course_structure_columns(self, data):
-        data.drop(["id", "parent_id"], axis=1, inplace=True)
-        data = data.query(f"system_code == 'd2735d92-6ad6-49c4-9b36-c3b16cee695d'")
-        data.rename({
-            "external_id": "id",
-            "external_parent_id": "parent_id",
-            # "courseName": "course_name",
-            "courseTypeId": "course_type_id",
-            "externalLink": "external_link"
-        }, axis=1, inplace=True)
-        # data["system_code"] =
-        return data  # lesson chapter topic course
-
-    def map_course_statistics_columns(self, data):
-        pass
-        # data.rename({
-        #     "createdAt": "created_at",
-        #     "statisticsTypeId": "statistic_type_id",
-        #     "userId": "profile_id",
-        #     "externalId": "educational_course_id",
-        # }, axis=1, inplace=True)
-        # return data[["profile_id", "educational_course_id", "created_at"]]
-
-    # def get_statistics_pre_table_name(self):
-    #     return "course_statistics_pre_uchi"
+    def get_id_encoders(self):
+        # profiles are looked up in the db batch by batch, the course catalogue is small enough to keep in memory
+        courses = self.shared_model.db.query(
+            "SELECT educational_course_id_uuid, course_id FROM course_information",
+            uuid_columns=["educational_course_id_uuid"]
+        )
+        return (
+            self.shared_model.mappings["profile_id"],
+            IdEncoder(dict(zip(courses["educational_course_id_uuid"], courses["course_id"])))
+        )
 
-    def get_statistics_table_name(self):
-        return "course_statistics_uchi"
+    def iterate_encoded(self, file, canonicalizer, profile_encoder, course_encoder):
+        for chunk in self.read_preprocessed_chunks(file):
+            course_ids, course_unresolved = course_encoder.encode(
+                canonicalizer.canonicalize(chunk["educational_course_id"])
+            )
+            profile_ids, profile_unresolved = profile_encoder.encode(chunk["profile_id"])
+            rejected = (course_unresolved | profile_unresolved | chunk["created_at"].isna()).to_numpy()
+            if rejected.any():
+                # rejected rows keep their original ids in the quarantine
+                self.shared_model.quarantine.add(
+                    chunk[rejected],
+                    np.select(
+                        [course_unresolved[rejected], profile_unresolved[rejected]],
+                        ["unresolved_educational_course_id", "unresolved_profile_id"], "missing_created_at"
+                    ),
+                    file
+                )
+            accepted = ~rejected
+            yield pd.DataFrame({
+                "profile_id": profile_ids[accepted],
+                "educational_course_id": course_ids[accepted],
+                "day": to_day_index(chunk["created_at"][accepted])
+            })
 
-    def get_active_days_count_table_name(self):
-        return "active_days_count_uchi"
+    def iterate_preprocessed(self, file, canonicalizer, profile_encoder, course_encoder):
+        # records repeat across chunks of a file, the deduplicator spills them into hash partitions
+        # and makes every (profile, course, day) of the file unique before it is written to the db,
+        # duplicates between files are removed and months added when the statistics are imported
+        deduplicator = HashPartitionDeduplicator(
+            ["profile_id", "educational_course_id", "day"], self.preprocessed_path,
+            memory_limit=self.args.dedup_memory_limit * 1024 ** 2
+        )
+        try:
+            for chunk in self.iterate_encoded(file, canonicalizer, profile_encoder, course_encoder):
+                deduplicator.add(chunk)
+            yield from deduplicator
+        finally:
+            deduplicator.close()
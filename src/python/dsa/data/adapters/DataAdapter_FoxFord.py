@@ -0,0 +1,76 @@
+import logging
+from pathlib import Path
+
+from dsa.data.CourseIdCanonicalizer import truncate_course_ids
+from dsa.data.adapters.DataAdapter import DataAdapter
+from dsa.data.adapters.StatisticsCombiner import map_partitions_foxford
+
+
+class DataAdapter_FoxFord(DataAdapter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    @staticmethod
+    def get_course_structure_path(args):
+        logging.info("Importing course statistics for FoxFord")
+        return Path(args.course_structure_foxford)
+
+    @staticmethod
+    def get_course_statistics_path(args):
+        return Path(args.course_statistics_foxford)
+
+    def preprocess(self, path):
+        files = self.get_raw_statistics_files(path)
+        self.preprocess_files(files, map_partitions_foxford)
+
+    def format_course_structure_columns(self, data):
+        data.rename({
+            "externalId": "id",
+            "externalParentId": "parent_id",
+            "courseName": "course_name",
+            "courseTypeId": "course_type_id",
+            "externalLink": "external_link"
+        }, axis=1, inplace=True)
+        data["system_code"] = "13788b9a-3426-45b2-9ba5-d8cec8c03c0c"
+        return data
+
+    def get_course_type(self, type_id):
+        if type_id == 0:
+            return "ЦОМ"
+        elif type_id == 2:
+            return "Урок"
+        elif type_id == 3:
+            return "Задача"
+        else:
+            raise ValueError()
+
+    def get_statistics_type(self, type_id):
+        if type_id == 0:
+            return  "login"
+        elif type_id == 2:
+            return "started_studying"
+        else:
+            return "logout"
+
+    def validate_structure_ids(self, data):
+        # repeated ids are allowed as long as they have the same parent
+        assert (data.groupby("id")["parent_id"].nunique(dropna=False) <= 1).all()
+
+    def map_course_statistics_columns(self, data):
+        data["educational_course_id"] = truncate_course_ids(data["educational_course_id"], 5)
+        return data
+
+    # def get_statistics_pre_table_name(self):
+    #     return "course_statistics_pre_foxford"
+
+    def get_statistics_table_name(self):
+        return "course_statistics_foxford"
+
+    def get_active_days_count_table_name(self):
+        return "active_days_count_foxford"
+
+    def get_course_structure_table_name(self):
+        return "course_structure_foxford"
+
+    def get_course_ancestry_table_name(self):
+        return "course_ancestry_foxford"
@@ -0,0 +1,57 @@
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from dsa.data.adapters.DataAdapter import DataAdapter, StructureUpdate
+from dsa.data.adapters.StatisticsCombiner import map_partitions_meo
+
+
+class DataAdapter_MEO(DataAdapter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    @staticmethod
+    def get_course_structure_path(args):
+        logging.info("Importing course statistics for MEO")
+        return Path(args.course_structure_meo)
+
+    @staticmethod
+    def get_course_statistics_path(args):
+        return Path(args.course_statistics_meo)
+
+    def preprocess(self, path):
+        files = self.get_raw_statistics_files(path)
+        self.preprocess_files(files, map_partitions_meo)
+
+    def format_course_structure_columns(self, data):
+        data.rename({"material_id": "educational_course_id"}, axis=1, inplace=True)
+        data["system_code"] = "61dbfd85-2f0b-49eb-ad60-343cc5f12a36"
+        return data.astype({"educational_course_id": "string"})
+
+    def map_course_statistics_columns(self, data):
+        # data.rename({
+        #     "Start": "created_at",
+        #     "profileId": "profile_id",
+        #     "CourseId": "educational_course_id",
+        # }, axis=1, inplace=True)
+        # data.astype({"educational_course_id": "Int64"}, inplace=True)
+        return data
+
+    def resolve_structure(self, data, full=False):
+        return StructureUpdate(courses=data, removed_ids=np.array([], dtype=object), nodes=None, ancestry=None)
+
+    # def get_statistics_pre_table_name(self):
+    #     return "course_statistics_pre_meo"
+
+    def get_statistics_table_name(self):
+        return "course_statistics_meo"
+
+    def get_active_days_count_table_name(self):
+        return "active_days_count_meo"
+
+    def get_course_structure_table_name(self):
+        return "course_structure_meo"
+
+    def get_course_ancestry_table_name(self):
+        return "course_ancestry_meo"
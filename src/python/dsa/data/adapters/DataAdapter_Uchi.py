@@ -0,0 +1,69 @@
+import logging
+from pathlib import Path
+
+from dsa.data.adapters.DataAdapter import DataAdapter
+from dsa.data.adapters.StatisticsCombiner import map_partitions_uchi
+
+
+class DataAdapter_Uchi(DataAdapter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    @staticmethod
+    def get_course_structure_path(args):
+        logging.info("Importing course statistics UCHI")
+        return Path(args.course_structure_uchi)
+
+    @staticmethod
+    def get_course_statistics_path(args):
+        return Path(args.course_statistics_uchi)
+
+    def preprocess(self, path):
+        files = self.get_raw_statistics_files(path)
+        self.preprocess_files(files, map_partitions_uchi)
+
+    def get_statistics_type(self, type_id):
+        if type_id == 0:
+            return "login"
+        elif type_id == 2:
+            return "started_studying"
+        else:
+            return "logout"
+
+    def format_course_structure_columns(self, data):
+        data.drop(["id", "parent_id"], axis=1, inplace=True)
+        data = data.query(f"system_code == 'd2735d92-6ad6-49c4-9b36-c3b16cee695d'")
+        data.rename({
+            "external_id": "id",
+            "external_parent_id": "parent_id",
+            # "courseName": "course_name",
+            "courseTypeId": "course_type_id",
+            "externalLink": "external_link"
+        }, axis=1, inplace=True)
+        # data["system_code"] =
+        return data  # lesson chapter topic course
+
+    def map_course_statistics_columns(self, data):
+        pass
+        # data.rename({
+        #     "createdAt": "created_at",
+        #     "statisticsTypeId": "statistic_type_id",
+        #     "userId": "profile_id",
+        #     "externalId": "educational_course_id",
+        # }, axis=1, inplace=True)
+        # return data[["profile_id", "educational_course_id", "created_at"]]
+
+    # def get_statistics_pre_table_name(self):
+    #     return "course_statistics_pre_uchi"
+
+    def get_statistics_table_name(self):
+        return "course_statistics_uchi"
+
+    def get_active_days_count_table_name(self):
+        return "active_days_count_uchi"
+
+    def get_course_structure_table_name(self):
+        return "course_structure_uchi"
+
+    def get_course_ancestry_table_name(self):
+        return "course_ancestry_uchi"
@@ -0,0 +1,21 @@
+from dsa.data.adapters.DataAdapter import DataAdapter
+
+
+class DataAdapter_United(DataAdapter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def get_statistics_pre_table_name(self):
+        return "course_statistics_pre_unified"
+
+    def get_statistics_table_name(self):
+        return "course_statistics_unified"
+
+    def get_active_days_count_table_name(self):
+        return "active_days_count_unified"
+
+    def get_course_structure_table_name(self):
+        return "course_structure_unified"
+
+    def get_course_ancestry_table_name(self):
+        return "course_ancestry_unified"
@@ -1,22 +1,92 @@
-from collections import namedtuple
+import io
+import logging
+import os
+import shutil
+from collections import namedtuple, Counter
+from functools import partial
 from multiprocessing import Pool
 from pathlib import Path
 
 from tqdm import tqdm
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dsa.data.CourseIdCanonicalizer import truncate_course_ids
+from dsa.data.ParallelBZ2Reader import open_parallel_bz2
+from dsa.data.PartitionManifest import PartitionManifest, PartitionState, PartitionProgress, prefix_checksum
+from dsa.data.PartitionRanges import get_range_count, split_partition, open_partition_range, open_partition_tail, \
+    get_processable_end, is_bz2, is_bz2_stream_start, read_file_header
 
 
 Record = namedtuple("Record", ["profile_id", "educational_course_id", "date", "day_start", "day_end"])
 
+WORKER_MEMORY_ESTIMATE = 2 * 1024 ** 3
+
+PREPROCESSED_SUFFIXES = {
+    "csv": "___preprocessed.csv.bz2",
+    "parquet": "___preprocessed.parquet",
+}
+
+
+class CSVDumpWriter:
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, content):
+        content.to_csv(self.path, mode="a", index=False, header=False, compression="bz2")
+
+    def close(self):
+        pass
+
+
+class ParquetDumpWriter:
+    schema = pa.schema([
+        ("profile_id", pa.dictionary(pa.int32(), pa.string())),
+        ("educational_course_id", pa.dictionary(pa.int32(), pa.string())),
+        ("created_at", pa.date32()),
+    ])
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def to_arrow(self, content):
+        return pa.Table.from_arrays([
+            pa.Array.from_pandas(content["profile_id"].astype("string")).dictionary_encode(),
+            pa.Array.from_pandas(content["educational_course_id"].astype("string")).dictionary_encode(),
+            pa.Array.from_pandas(content["created_at"]).cast(pa.date32()),
+        ], schema=self.schema)
+
+    def write(self, content):
+        # every chunk becomes its own row group, so readers can stream the dump chunk by chunk
+        self.writer.write_table(self.to_arrow(content), row_group_size=len(content) or None)
+
+    def close(self):
+        self.writer.close()
+
 
 class StatisticsCombiner:
-    def __init__(self):
+    def __init__(self, output_format="csv", decompression_threads=None):
         self.delim = ","
         self.check_45_min = False
-
-    def preprocess_course_id(self, id_):
-        return id_
+        if output_format not in PREPROCESSED_SUFFIXES:
+            raise ValueError(f"Unknown output format: {output_format}")
+        self.output_format = output_format
+        self.decompression_threads = decompression_threads
+        self.course_id_levels = None
+        self.block_size = 128 * 1024 ** 2
+
+    def preprocess_course_ids(self, ids):
+        if self.course_id_levels is None:
+            return ids
+        return truncate_course_ids(ids, self.course_id_levels)
+
+    def open_partition(self, partition_file, start=0, end=None):
+        if start == 0 and partition_file.name.endswith(".bz2") and self.decompression_threads != 1:
+            return open_parallel_bz2(partition_file, threads=self.decompression_threads, size=end)
+        return open_partition_tail(partition_file, start, end)
 
     def read_partition_chunks(self, partition_file):
         return pd.read_csv(
@@ -36,50 +106,150 @@ class StatisticsCombiner:
         if not preprocessed_folder.is_dir():
             preprocessed_folder.mkdir()
         filename = path.name
-        dump_filename = preprocessed_folder.joinpath(filename + "___preprocessed.csv.bz2")
+        dump_filename = preprocessed_folder.joinpath(filename + PREPROCESSED_SUFFIXES[self.output_format])
         return dump_filename
 
-    def append_to_dump_file(self, path, content):
-        content.to_csv(path, mode="a", index=False, header=False)
-
-    def map_partition(self, partition_file: Path):
+    def open_dump_writer(self, path):
+        if self.output_format == "parquet":
+            return ParquetDumpWriter(path)
+        else:
+            return CSVDumpWriter(path)
+
+    def get_partition_status(self, partition_file, dump_filename):
+        status, state = PartitionManifest(dump_filename).get_status(partition_file)
+        if status == "append" and is_bz2(partition_file) and not is_bz2_stream_start(partition_file, state.offset):
+            status, state = "rebuild", None
+        if status == "rebuild":
+            if dump_filename.is_file():
+                dump_filename.unlink()
+            state = PartitionState(0, 0, 0)
+        return status, state
+
+    def write_dump_file(self, path, chunks):
+        # output is written under a temporary name and renamed only when complete
+        temp_path = path.with_name(path.name + ".tmp")
+        if temp_path.is_file():
+            temp_path.unlink()
+        dump_writer = self.open_dump_writer(temp_path)
+        try:
+            rows = self.process_chunks(chunks, dump_writer)
+        finally:
+            dump_writer.close()
+        if temp_path.is_file():
+            os.replace(temp_path, path)
+        return rows
+
+    def map_partition_range(self, partition_file, dump_filename, partition_range):
+        print(partition_file, f"range {partition_range.index}")
+
+        with open_partition_range(partition_file, partition_range) as source:
+            return self.write_dump_file(
+                get_part_path(dump_filename, partition_range.index), tqdm(self.read_partition_chunks(source))
+            )
+
+    def iterate_source_blocks(self, partition_file, start, end, committed):
+        # blocks end on line boundaries, so every committed block is identified by its end offset
+        # in the source stream after the header, and a restarted run continues right after the last one
+        if is_bz2(partition_file) or committed == 0:
+            source, skip = self.open_partition(partition_file, start, end), committed
+        else:
+            header_size = len(read_file_header(partition_file)) if start == 0 else 0
+            source, skip = self.open_partition(partition_file, start + header_size + committed, end), 0
+        with source:
+            header = source.readline()
+            while skip > 0:
+                skipped = len(source.read(min(skip, self.block_size)))
+                if skipped == 0:
+                    break
+                skip -= skipped
+            while True:
+                block = source.read(self.block_size)
+                if len(block) == 0:
+                    break
+                yield header, block + source.readline()
+
+    def process_blocks(self, partition_file, manifest, progress):
+        committed = progress.done[-1][0] if len(progress.done) > 0 else 0
+        manifest.chunks_path.mkdir(exist_ok=True)
+        for header, block in tqdm(self.iterate_source_blocks(partition_file, progress.start, progress.end, committed)):
+            chunk_path = manifest.get_chunk_path(len(progress.done), PREPROCESSED_SUFFIXES[self.output_format])
+            rows = self.write_dump_file(chunk_path, self.read_partition_chunks(io.BytesIO(header + block)))
+            committed += len(block)
+            progress.done.append([committed, rows])
+            manifest.save_progress(progress)
+
+    def map_partition(self, partition_file: Path, partition_range=None):
 
         dump_filename = self.get_dump_path(partition_file)
 
-        if dump_filename.is_file():
-            return
-
+        if partition_range is not None:
+            return self.map_partition_range(partition_file, dump_filename, partition_range)
+
+        # raw dumps usually grow by appending, then only the unprocessed tail is parsed
+        status, state = self.get_partition_status(partition_file, dump_filename)
+        if status == "current":
+            return 0
+
+        manifest = PartitionManifest(dump_filename)
+        progress = manifest.get_resumable_progress(partition_file, "chunks", state.offset)
+        if progress is None:
+            end = get_processable_end(partition_file)
+            manifest.clear_chunks()
+            progress = PartitionProgress(
+                "chunks", state.offset, end, prefix_checksum(partition_file, end), manifest.get_base_size(), None, []
+            )
+            manifest.save(state if status == "append" else None, progress)
+
+        print(partition_file, "from byte", state.offset)
+        if len(progress.done) > 0:
+            logging.info(f"Resuming {partition_file} after {len(progress.done)} committed chunks")
+
+        if not manifest.is_output_in_place(progress):
+            self.process_blocks(partition_file, manifest, progress)
+            previous = [dump_filename] if status == "append" else []
+            chunk_suffix = PREPROCESSED_SUFFIXES[self.output_format]
+            write_merged_dump(
+                dump_filename,
+                previous + [manifest.get_chunk_path(index, chunk_suffix) for index in range(len(progress.done))]
+            )
+
+        rows = sum(chunk_rows for _, chunk_rows in progress.done)
+        manifest.save(PartitionState(progress.end, state.rows + rows, progress.checksum))
+        manifest.clear_chunks()
+        return rows
+
+    def process_chunks(self, chunks, dump_writer):
         col_order = ["profile_id", "educational_course_id", "created_at"]
 
-        print(partition_file)
-
-        for chunk in tqdm(self.read_partition_chunks(partition_file)):
+        rows = 0
+        for chunk in chunks:
+            rows += len(chunk)
             chunk.dropna(subset=col_order, inplace=True)
-            chunk["educational_course_id"] = chunk["educational_course_id"].apply(self.preprocess_course_id)
+            chunk["educational_course_id"] = self.preprocess_course_ids(chunk["educational_course_id"])
             chunk.sort_values(by=col_order, inplace=True)
 
             chunk["created_at"] = chunk["created_at"].dt.normalize()
             chunk.drop_duplicates(col_order, inplace=True)
 
-            self.append_to_dump_file(dump_filename, chunk[col_order])
+            dump_writer.write(chunk[col_order])
+
+        return rows
 
 
 class StatisticsCombiner_Uchi(StatisticsCombiner):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
 
 
 class StatisticsCombiner_FoxFord(StatisticsCombiner):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
         self.check_45_min = True
+        self.course_id_levels = 5
 
     def set_column_order(self):
         self.column_order = {"profile_id": 1, "created_at": 2, "educational_course_id": 5}
 
-    def preprocess_course_id(self, id_):
-        return "/".join(id_.split("/")[:5])
-
     def read_partition_chunks(self, partition_file):
         return pd.read_csv(
             partition_file,
@@ -94,8 +264,8 @@ class StatisticsCombiner_FoxFord(StatisticsCombiner):
 
 
 class StatisticsCombiner_MEO(StatisticsCombiner):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
 
     def read_partition_chunks(self, partition_file):
         return pd.read_csv(
@@ -127,8 +297,8 @@ class StatisticsCombiner_MEO(StatisticsCombiner):
 
 
 class StatisticsCombiner_1C_ND(StatisticsCombiner):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
 
     def read_partition_chunks(self, partition_file):
         return pd.read_csv(
@@ -143,38 +313,181 @@ class StatisticsCombiner_1C_ND(StatisticsCombiner):
         )
 
 
-def map_partitions_uchi(file):
-    uchi_combiner = StatisticsCombiner_Uchi()
-    uchi_combiner.map_partition(file)
+def map_partitions_uchi(file, partition_range=None, **kwargs):
+    uchi_combiner = StatisticsCombiner_Uchi(**kwargs)
+    return uchi_combiner.map_partition(file, partition_range)
+
+
+def map_partitions_foxford(file, partition_range=None, **kwargs):
+    foxford_combiner = StatisticsCombiner_FoxFord(**kwargs)
+    return foxford_combiner.map_partition(file, partition_range)
+
 
+def map_partitions_meo(file, partition_range=None, **kwargs):
+    meo_combiner = StatisticsCombiner_MEO(**kwargs)
+    return meo_combiner.map_partition(file, partition_range)
 
-def map_partitions_foxford(file):
-    foxford_combiner = StatisticsCombiner_FoxFord()
-    foxford_combiner.map_partition(file)
 
+def map_partitions_1c_nd(file, partition_range=None, **kwargs):
+    combiner = StatisticsCombiner_1C_ND(**kwargs)
+    return combiner.map_partition(file, partition_range)
 
-def map_partitions_meo(file):
-    meo_combiner = StatisticsCombiner_MEO()
-    meo_combiner.map_partition(file)
 
+def get_memory_budget(memory_budget=None):
+    if memory_budget is None and os.environ.get("DSA_PREPROCESS_MEMORY_BUDGET"):
+        memory_budget = float(os.environ["DSA_PREPROCESS_MEMORY_BUDGET"])
+    if memory_budget is not None:
+        return int(memory_budget * 1024 ** 3)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
 
-def map_partitions_1c_nd(file):
-    combiner = StatisticsCombiner_1C_ND()
-    combiner.map_partition(file)
 
+def get_worker_count(workers=None, memory_budget=None):
+    if workers is None and os.environ.get("DSA_PREPROCESS_WORKERS"):
+        workers = int(os.environ["DSA_PREPROCESS_WORKERS"])
+    if workers is None:
+        workers = os.cpu_count() or 1
+        memory_budget = get_memory_budget(memory_budget)
+        if memory_budget is not None:
+            workers = min(workers, memory_budget // WORKER_MEMORY_ESTIMATE)
+    return max(1, workers)
 
-def preprocess(files, partition_fn):
+
+def get_part_path(dump_filename, index):
+    return dump_filename.with_name(dump_filename.name + f".part{index:04d}")
+
+
+def write_merged_dump(dump_filename, sources):
+    sources = [source for source in sources if source.is_file()]
+    if len(sources) == 0:
+        return
+    temp_path = dump_filename.with_name(dump_filename.name + ".tmp")
+    if dump_filename.name.endswith(PREPROCESSED_SUFFIXES["parquet"]):
+        # row groups are copied over as they are, nothing is parsed again
+        writer = pq.ParquetWriter(temp_path, ParquetDumpWriter.schema, compression="zstd")
+        for source in sources:
+            source_file = pq.ParquetFile(source)
+            for group in range(source_file.num_row_groups):
+                writer.write_table(source_file.read_row_group(group))
+        writer.close()
+    else:
+        # bz2 streams can be concatenated, the result is read as one multi-stream file
+        with open(temp_path, "wb") as dump:
+            for source in sources:
+                with open(source, "rb") as source_file:
+                    shutil.copyfileobj(source_file, dump)
+    os.replace(temp_path, dump_filename)
+
+
+def remove_parts(dump_filename):
+    for part in dump_filename.parent.glob(dump_filename.name + ".part*"):
+        part.unlink()
+
+
+def get_split_progress(file, num_ranges, combiner):
+    manifest = PartitionManifest(combiner.get_dump_path(file))
+    progress = manifest.get_resumable_progress(file, "ranges", 0)
+    end = get_processable_end(file) if progress is None else progress.end
+    ranges = split_partition(file, num_ranges, end)
+    if progress is None or progress.num_ranges != len(ranges):
+        remove_parts(manifest.dump_path)
+        progress = PartitionProgress("ranges", 0, end, prefix_checksum(file, end), None, len(ranges), {})
+        manifest.save(None, progress)
+    # ranges finished by an interrupted run are not processed again
+    return progress, [partition_range for partition_range in ranges if str(partition_range.index) not in progress.done]
+
+
+def get_preprocessing_tasks(files, workers, split_partitions, output_format):
+    tasks = []
+    split_progress = {}
+    combiner = StatisticsCombiner(output_format=output_format)
+    for file in files:
+        if split_partitions:
+            num_ranges = get_range_count(file, workers)
+            if num_ranges > 1:
+                status, _ = combiner.get_partition_status(file, combiner.get_dump_path(file))
+                if status == "current":
+                    continue
+                if status == "rebuild":
+                    split_progress[file], ranges = get_split_progress(file, num_ranges, combiner)
+                    tasks.extend((file, partition_range) for partition_range in ranges)
+                    continue
+        # appended tails are small, they are processed by map_partition as a whole
+        tasks.append((file, None))
+
+    def task_size(task):
+        file, partition_range = task
+        return Path(file).stat().st_size if partition_range is None else partition_range.size
+
+    # the largest tasks go first, so that a big file does not start last and keep the others waiting
+    return sorted(tasks, key=task_size, reverse=True), split_progress
+
+
+def run_partition_fn(partition_fn, task):
+    file, partition_range = task
+    try:
+        rows = partition_fn(file, partition_range)
+    except Exception as e:
+        logging.exception(f"Failed to preprocess {file}")
+        return file, partition_range, 0, e
+    return file, partition_range, rows, None
+
+
+def finish_split_partition(file, progress, output_format):
+    dump_filename = StatisticsCombiner(output_format=output_format).get_dump_path(file)
+    manifest = PartitionManifest(dump_filename)
+    if not manifest.is_output_in_place(progress):
+        write_merged_dump(dump_filename, [get_part_path(dump_filename, index) for index in range(progress.num_ranges)])
+    manifest.save(PartitionState(progress.end, sum(progress.done.values()), progress.checksum))
+    remove_parts(dump_filename)
+
+
+def preprocess(files, partition_fn, workers=None, memory_budget=None, split_partitions=False, **kwargs):
 
     files = list(files)
 
     if len(files) == 0:
         return
 
-    with Pool(4) as p:
-        p.map(partition_fn, files)
+    output_format = kwargs.get("output_format", "csv")
+    workers = get_worker_count(workers, memory_budget)
+    tasks, split_progress = get_preprocessing_tasks(files, workers, split_partitions, output_format)
+
+    remaining = Counter(file for file, _ in tasks)
+    for file, progress in split_progress.items():
+        if remaining[file] == 0:
+            finish_split_partition(file, progress, output_format)
+
+    if len(tasks) == 0:
+        return
 
-    # for file in files:
-    #     partition_fn(file)
+    workers = min(workers, len(tasks))
+    if kwargs.get("decompression_threads") is None:
+        # share the cores between the workers instead of starting cpu_count threads in each of them
+        kwargs["decompression_threads"] = max(1, (os.cpu_count() or 1) // workers)
+
+    logging.info(f"Preprocessing {len(files)} files as {len(tasks)} tasks with {workers} workers")
+
+    failed = set()
+    with Pool(workers) as p:
+        completed = p.imap_unordered(partial(run_partition_fn, partial(partition_fn, **kwargs)), tasks)
+        for ind, (file, partition_range, rows, error) in enumerate(completed):
+            if error is not None:
+                failed.add(file)
+            elif partition_range is not None:
+                progress = split_progress[file]
+                progress.done[str(partition_range.index)] = rows
+                PartitionManifest(StatisticsCombiner(output_format=output_format).get_dump_path(file)) \
+                    .save_progress(progress)
+            remaining[file] -= 1
+            if remaining[file] == 0 and file in split_progress and file not in failed:
+                finish_split_partition(file, split_progress[file], output_format)
+            logging.info(f"Preprocessed {ind + 1}/{len(tasks)}: {file}")
+
+    if len(failed) > 0:
+        raise RuntimeError(f"Preprocessing failed for {len(failed)} files: {', '.join(map(str, failed))}")
 
 
 def get_files_from_dir(statistics_folder):
@@ -186,6 +499,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--platform")
     parser.add_argument("--path")
+    parser.add_argument("--preprocessed_format", default="csv", choices=list(PREPROCESSED_SUFFIXES))
+    parser.add_argument("--decompression_threads", default=None, type=int)
+    parser.add_argument("--preprocess_workers", default=None, type=int)
+    parser.add_argument("--preprocess_memory_budget", default=None, type=float, help="GiB")
+    parser.add_argument("--split_partitions", action="store_true")
     args = parser.parse_args()
 
     processing_fns = {
@@ -199,8 +517,12 @@ if __name__ == "__main__":
     if platform in {"uchi", "uchi_new", "foxford", "meo"}:
         statistics_folder = Path(args.path)
         files = get_files_from_dir(statistics_folder)
-        preprocess(files, processing_fns[platform])
+        preprocess(files, processing_fns[platform], output_format=args.preprocessed_format,
+                   decompression_threads=args.decompression_threads, workers=args.preprocess_workers,
+                   memory_budget=args.preprocess_memory_budget, split_partitions=args.split_partitions)
     elif platform == "1c_nd":
         statistics_file = Path(args.path)
-        preprocess([statistics_file], processing_fns[platform])
+        preprocess([statistics_file], processing_fns[platform], output_format=args.preprocessed_format,
+                   decompression_threads=args.decompression_threads, workers=args.preprocess_workers,
+                   memory_budget=args.preprocess_memory_budget, split_partitions=args.split_partitions)
 
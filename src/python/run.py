@@ -5,6 +5,7 @@ from pathlib import Path
 from dsa import SharedModel
 from dsa.writers import ReportWriter, BillingReportWriter, RegionReportWriter, SchoolActivityReportWriter
 from dsa import Reporter
+from dsa.data.adapters.AdapterRegistry import ADAPTERS
 
 
 def get_last_export(path):
@@ -21,14 +22,14 @@ def parse_arguments():
     parser.add_argument("--external_system", default=None)
     parser.add_argument("--profile_educational_institution", default=None)
     parser.add_argument("--course_structure", default=None)
-    # parser.add_argument("--course_structure_foxford", default=None)
-    # parser.add_argument("--course_structure_meo", default=None)
-    # parser.add_argument("--course_structure_uchi", default=None)
+    parser.add_argument("--course_structure_foxford", default=None)
+    parser.add_argument("--course_structure_meo", default=None)
+    parser.add_argument("--course_structure_uchi", default=None)
     parser.add_argument("--course_types", default=None)
     parser.add_argument("--course_statistics", default=None)
-    # parser.add_argument("--course_statistics_foxford", default=None)
-    # parser.add_argument("--course_statistics_uchi", default=None)
-    # parser.add_argument("--course_statistics_meo", default=None)
+    parser.add_argument("--course_statistics_foxford", default=None)
+    parser.add_argument("--course_statistics_uchi", default=None)
+    parser.add_argument("--course_statistics_meo", default=None)
     parser.add_argument("--region_info", default=None)
     parser.add_argument("--educational_institution", default=None)
     parser.add_argument("--last_export", default=None)
@@ -38,6 +39,15 @@ def parse_arguments():
     parser.add_argument("--start_date", default=None, type=str)
     parser.add_argument("--payed", default=None)
     parser.add_argument("--minute_activity", action="store_true")
+    parser.add_argument("--preprocessed_format", default="csv", choices=["csv", "parquet"])
+    parser.add_argument("--decompression_threads", default=None, type=int)
+    parser.add_argument("--preprocess_workers", default=None, type=int)
+    parser.add_argument("--preprocess_memory_budget", default=None, type=float, help="GiB")
+    parser.add_argument("--split_partitions", action="store_true")
+    parser.add_argument("--dedup_memory_limit", default=1024, type=int, help="MiB")
+    parser.add_argument("--adapters", default=["united"], nargs="+", choices=list(ADAPTERS))
+    parser.add_argument("--adapter_workers", default=None, type=int)
+    parser.add_argument("--loader_workers", default=None, type=int)
     args = parser.parse_args()
     return args
 